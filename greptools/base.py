@@ -1,12 +1,23 @@
 """Core of the package, contains the bootstrapping logic for each tool."""
-from sys import stdout, stdin, exit
+import os.path
+import sys
+from sys import exit
 from json import dumps
-from argparse import ArgumentParser, RawTextHelpFormatter
+from argparse import ArgumentParser, ArgumentTypeError, RawTextHelpFormatter
 
+from greptools import stats
 from greptools.publisher import (ColouredPublisher,
                             CleanPublisher,
                             FilePublisher,
                             HistPublisher)
+from greptools.searcher import Searcher
+
+def non_negative_int(text):
+    """argparse type for options that can't be negative."""
+    value = int(text)
+    if value < 0:
+        raise ArgumentTypeError("can't be negative: %s" % text)
+    return value
 
 def bullet_list(inp):
     """Convienience function that joins elements of a list into a bullet
@@ -15,7 +26,9 @@ def bullet_list(inp):
 
 class GrepTools(object):
     """Used to bootstrap all greptools CLIs.
-    Takes a subclass of `BaseReader` and a list of CLI arguements as params. """
+    Takes a subclass of `BaseReader` and a list of CLI arguements as params.
+    stdin/stdout/stderr default to those of this process (see
+    greptools.server). """
     # CONSTANTS
     DESCRIPTION = '%s Grep Tool.'
     EPILOG = 'Author: Nic Roland\nEmail: nicroland9@gmail.com\nTwitter: @nicr9_'
@@ -27,14 +40,18 @@ class GrepTools(object):
             'hist': HistPublisher,
             }
 
-    def __init__(self, reader_cls, args):
+    def __init__(self, reader_cls, args, stdin=None, stdout=None,
+                 stderr=None):
         self.reader_type = reader_cls.TYPE
         self.reader_cls = reader_cls
+        self.stdin = sys.stdin if stdin is None else stdin
+        self.stdout = sys.stdout if stdout is None else stdout
+        self.stderr = sys.stderr if stderr is None else stderr
 
         self.config = self.parse_args(args)
 
         # Disable config.debug if stdout is a pipe
-        if not stdout.isatty() and not self.config.force_publish:
+        if not self.stdout.isatty() and not self.config.force_publish:
             self.config.debug = False
 
         if self.config.debug:
@@ -44,57 +61,136 @@ class GrepTools(object):
             print "=== pygt config ==="
             print dumps(config_pretty, indent=4) + '\n'
 
-        self.run()
+        if self.config.stats:
+            stats.start()
+        try:
+            self.run()
+        finally:
+            if self.config.stats:
+                self.report_stats(stats.stop())
+
+    def report_stats(self, collected):
+        """Write the timings and counters collected by --stats to stderr or
+        --stats-file."""
+        if self.config.stats_file:
+            with open(self.config.stats_file, 'w') as outp:
+                collected.report(outp, self.config.stats_format)
+        else:
+            collected.report(self.stderr, self.config.stats_format)
 
     def run(self):
         """Execute the search, filter, format, print results."""
-        # Either load results from pipe or grep new ones
-        if stdin.isatty():
+        if self.config.build_index:
+            searcher = Searcher(self.config, self.reader_cls.FILE_PATTERNS)
+            with stats.stage('build_index'):
+                files, read = searcher.build_index()
+            if self.config.search_term is None:
+                print "Indexed %d files (%d new or changed)" % (files, read)
+                exit()
+
+        # Either refresh saved results, load results from pipe or grep new ones
+        if self.config.refresh:
             if self.config.search_term is None:
                 exit()
             else:
-                reader = self.reader_cls.from_grep(self.config)
+                reader = self.reader_cls.from_refresh(self.config)
+        elif self.stdin.isatty():
+            if self.config.search_term is None:
+                exit()
+            else:
+                streaming = self.streaming_publisher()
+                reader = self.reader_cls.from_grep(
+                        self.config,
+                        streaming and self.timed(streaming.publish_file)
+                        )
+                if streaming:
+                    # Everything has already been published as it was found
+                    streaming.finish(reader.tree.truncated)
+                    return
         else:
-            reader = self.reader_cls.from_pipe(self.config)
+            # Union and XOR search everything, so get started while the
+            # results piped in are still being read
+            search = None
+            if self.config.union or self.config.diff:
+                search = self.reader_cls.search_in_background(self.config)
+
+            reader = self.reader_cls.from_pipe(self.config, self.stdin)
 
             # Set operations
-            if self.config.union:
-                reader.union()
-            elif self.config.diff:
-                reader.diff()
-            elif self.config.fast_exclude:
-                reader.fast_exclude()
-            elif self.config.exclude:
-                reader.exclude()
-            elif self.config.inter:
-                reader.inter()
-            else:
-                reader.fast_inter()
+            with stats.stage('set_op'):
+                if self.config.union:
+                    reader.union(search.get())
+                elif self.config.diff:
+                    reader.diff(search.get())
+                elif self.config.fast_exclude:
+                    reader.fast_exclude()
+                elif self.config.exclude:
+                    reader.exclude()
+                elif self.config.inter:
+                    reader.inter()
+                else:
+                    reader.fast_inter()
 
         if self.config.debug:
             print "=== Results dict ==="
             print dumps(reader.tree.data, indent=4) + '\n'
 
+        # Push to stdout or dump tree to pipe
+        if self.stdout.isatty() or self.config.force_publish:
+            pub = self.publisher()
+            with stats.stage('publish'):
+                pub.publish(reader.tree)
+        elif self.config.json:
+            with stats.stage('encode'):
+                reader.tree.dump(self.stdout)
+        else:
+            with stats.stage('encode'):
+                reader.tree.dump_binary(self.stdout)
+
+    @staticmethod
+    def timed(publish_file):
+        """Count the time spent publishing each file towards --stats."""
+        def _publish_file(file_path, node):
+            with stats.stage('publish'):
+                publish_file(file_path, node)
+
+        return _publish_file
+
+    def publisher(self):
+        """Create the publisher for the chosen format."""
         # We can't publish with colour to a pipe because it's ugly
         format_ = self.config.outp_format
         if self.config.force_publish:
             if format_ == 'colour':
                 format_ = 'clean'
 
-        # Push to stdout or dump tree to pipe
-        if stdout.isatty() or self.config.force_publish:
-            publisher = self.VALID_FORMATS[format_]
-            pub = publisher(self.config)
-            pub.publish(reader.tree)
-        else:
-            reader.tree.dump(stdout)
+        return self.VALID_FORMATS[format_](self.config)
+
+    def streaming_publisher(self):
+        """The publisher to print each file with as soon as it's resolved, or
+        None if results have to be collected first (e.g. to print them for
+        debugging, or to count them for a histogram)."""
+        if not (self.stdout.isatty() or self.config.force_publish):
+            return None
+        if self.config.debug:
+            return None
+
+        pub = self.publisher()
+        return pub if pub.STREAMING else None
 
     def parse_args(self, argv):
         """For parsing CLI arguements."""
+        parser = self.arg_parser(self.reader_type, os.path.basename(argv[0]))
+        return parser.parse_args(argv[1:])
+
+    @classmethod
+    def arg_parser(cls, reader_type, prog=None):
+        """The ArgumentParser for a greptool's CLI arguements."""
         parser = ArgumentParser(
+                prog=prog,
                 formatter_class=RawTextHelpFormatter,
-                description=self.DESCRIPTION % self.reader_type,
-                epilog=self.EPILOG
+                description=cls.DESCRIPTION % reader_type,
+                epilog=cls.EPILOG
                 )
 
         parser.add_argument(
@@ -125,6 +221,19 @@ class GrepTools(object):
                 dest='ignore_file'
                 )
 
+        inp_ops.add_argument(
+                '-e',
+                default=None,
+                action='append',
+                type=str,
+                metavar='PATTERN',
+                help="Another regex for the default intersection and -F\n"
+                        "to filter piped results by, can be repeated\n"
+                        "(e.g. `pygt a | pygt b -e c` is `pygt a | pygt b |\n"
+                        "pygt c`).",
+                dest='patterns'
+                )
+
         inp_ops.add_argument(
                 '-i',
                 action='store_true',
@@ -132,6 +241,103 @@ class GrepTools(object):
                 dest='case_off',
                 )
 
+        inp_ops.add_argument(
+                '-m',
+                '--max-count',
+                default=None,
+                type=int,
+                metavar='NUM',
+                help="Stop searching after NUM matches.",
+                dest='max_count'
+                )
+
+        inp_ops.add_argument(
+                '--max-per-file',
+                default=None,
+                type=int,
+                metavar='NUM',
+                help="Keep no more than NUM matches from each file.",
+                dest='max_per_file'
+                )
+
+        inp_ops.add_argument(
+                '--max-files',
+                default=None,
+                type=int,
+                metavar='NUM',
+                help="Stop searching after finding matches in NUM files.",
+                dest='max_files'
+                )
+
+        inp_ops.add_argument(
+                '-b',
+                '--backend',
+                default='grep',
+                choices=Searcher.BACKENDS,
+                help="How to search files:\n"
+                        "- grep : run grep (uses grep's regex syntax)\n"
+                        "- git : run git grep if in a git work tree\n"
+                        "- python : search in process with python's re",
+                dest='backend',
+                )
+
+        inp_ops.add_argument(
+                '-j',
+                default=1,
+                type=non_negative_int,
+                help="Number of grep processes to search with and of\n"
+                        "processes to work out contexts with (0 uses one\n"
+                        "per CPU).",
+                dest='jobs',
+                )
+
+        inp_ops.add_argument(
+                '--cache',
+                action='store_true',
+                help="Cache the outline of each file and the results\n"
+                        "of each search under .greptools/ so unchanged\n"
+                        "files aren't scanned again.",
+                dest='cache',
+                )
+
+        inp_ops.add_argument(
+                '--exact',
+                action='store_true',
+                help="Work out contexts with a parser for the language\n"
+                        "(if there is one) instead of a heuristic.",
+                dest='exact',
+                )
+
+        inp_ops.add_argument(
+                '--build-index',
+                action='store_true',
+                help="Create or refresh a trigram index of the files\n"
+                        "under .greptools/ that later searches use to skip\n"
+                        "files that can't match.",
+                dest='build_index',
+                )
+
+        inp_ops.add_argument(
+                '--refresh',
+                default=None,
+                type=str,
+                metavar='SNAPSHOT',
+                help="Bring the results saved at SNAPSHOT up to date,\n"
+                        "only searching files that changed since (it's\n"
+                        "created if it doesn't exist).",
+                dest='refresh',
+                )
+
+        inp_ops.add_argument(
+                '--since',
+                default=None,
+                type=str,
+                metavar='REV',
+                help="With --refresh, ask git which files changed since\n"
+                        "REV instead of checking their size and mtime.",
+                dest='since',
+                )
+
         set_ops = parser.add_argument_group(
                 "set operations",
                 "Used when piping one set of results into an other."
@@ -183,7 +389,7 @@ class GrepTools(object):
                 default='colour',
                 type=str,
                 help='Format to display output in:%s'
-                        % bullet_list(self.VALID_FORMATS),
+                        % bullet_list(cls.VALID_FORMATS),
                 dest='outp_format'
                 )
 
@@ -201,4 +407,41 @@ class GrepTools(object):
                 dest='force_publish'
                 )
 
-        return parser.parse_args(argv[1:])
+        outp_ops.add_argument(
+                '--json',
+                action='store_true',
+                help="Pipe results out as json instead of the compact\n"
+                        "binary format used between greptools.",
+                dest='json'
+                )
+
+        outp_ops.add_argument(
+                '--stats',
+                action='store_true',
+                help="Report the wall and CPU time of each stage of the\n"
+                        "search along with counters (files opened, bytes\n"
+                        "read, cache hits, ...) to stderr.",
+                dest='stats'
+                )
+
+        outp_ops.add_argument(
+                '--stats-format',
+                default='text',
+                choices=stats.FORMATS,
+                help="Format of the --stats report:\n"
+                        "- text : a table\n"
+                        "- json : for scripts that track regressions\n"
+                        "- trace : Chrome's trace event format",
+                dest='stats_format'
+                )
+
+        outp_ops.add_argument(
+                '--stats-file',
+                default=None,
+                type=str,
+                metavar='PATH',
+                help="Write the --stats report to PATH instead of stderr.",
+                dest='stats_file'
+                )
+
+        return parser
@@ -0,0 +1,518 @@
+"""Benchmarks for the greptools, run with `python -m greptools.bench`.
+
+A synthetic tree of files is generated for each reader (see generate()), then
+each reader, search backend, set operation and publisher is timed against it.
+Results can be saved as json lines tagged with the current commit so runs on
+different commits can be compared (see --compare). Scaling checks time the
+same benchmark as one dimension of the corpus grows and flag anything that
+grows faster than linearly."""
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from argparse import ArgumentParser
+from cStringIO import StringIO
+from random import Random
+from tempfile import mkdtemp
+
+from greptools.base import GrepTools
+from greptools.greptree import GrepTree
+from greptools.reader import PythonReader, MarkdownReader, JavaReader, GoReader
+from greptools.searcher import Searcher
+
+READERS = dict((z.TYPE, z) for z in [
+        PythonReader,
+        MarkdownReader,
+        JavaReader,
+        GoReader,
+        ])
+
+# Hit lines contain needle_0 to needle_9, the two sides of set operations
+# search for overlapping ranges of them
+QUERY = 'needle_'
+LEFT_QUERY = 'needle_[0-5]'
+RIGHT_QUERY = 'needle_[3-9]'
+
+# Scaling exponents above this are flagged as super-linear
+SUPERLINEAR = 1.25
+
+def make_config(**kwargs):
+    """A config with the same defaults as the command line, searching for
+    QUERY and publishing in the clean format even though stdout isn't a
+    terminal. kwargs override any of it."""
+    config = GrepTools.arg_parser('Bench').parse_args(
+            ['-p', '-f', 'clean', QUERY]
+            )
+    for key, val in kwargs.iteritems():
+        setattr(config, key, val)
+
+    return config
+
+class Corpus(object):
+    """Writes files for one reader, each made of sections nested depth
+    scopes deep with some lines of code in the innermost one. hits of those
+    lines contain a needle.
+
+    Subclasses say how to open a scope and write a line at a given depth."""
+    EXTENSION = ''
+    BODY = 8
+
+    def __init__(self, files=50, depth=3, hits=5, lines=200, seed=0):
+        self.files = files
+        self.depth = depth
+        self.hits = hits
+        self.lines = lines
+        self.seed = seed
+
+    def write(self, root):
+        """Generate the files under root, returns the number of hits."""
+        rand = Random(self.seed)
+        total = 0
+        for indx in xrange(self.files):
+            dir_path = os.path.join(root, 'pkg%d' % (indx % 10))
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+
+            path = os.path.join(dir_path, 'mod%d%s' % (indx, self.EXTENSION))
+            text, hits = self.file_text(rand)
+            with open(path, 'w') as outp:
+                outp.write(text)
+            total += hits
+
+        return total
+
+    def file_text(self, rand):
+        """Returns the text of one file and the number of hits in it."""
+        per_section = self.depth + self.BODY
+        sections = max(1, self.lines // per_section)
+        slots = sections * self.BODY
+        hits = set(rand.sample(xrange(slots), min(self.hits, slots)))
+
+        out = []
+        slot = 0
+        for section in xrange(sections):
+            for level in xrange(self.depth):
+                out.append(self.open_scope(section, level))
+            for _ in xrange(self.BODY):
+                needle = slot % 10 if slot in hits else None
+                out.append(self.line(slot, self.depth, needle))
+                slot += 1
+            for level in reversed(xrange(self.depth)):
+                out.append(self.close_scope(level))
+
+        return ''.join(z for z in out if z), len(hits)
+
+    def open_scope(self, section, level):
+        raise NotImplementedError
+
+    def close_scope(self, level):
+        return ''
+
+    def line(self, slot, depth, needle):
+        raise NotImplementedError
+
+    @staticmethod
+    def name(slot, needle):
+        return 'value_%d' % slot if needle is None else 'needle_%d' % needle
+
+class PythonCorpus(Corpus):
+    EXTENSION = '.py'
+
+    def open_scope(self, section, level):
+        if level == 0:
+            return 'class Section%d(object):\n' % section
+        return '%sdef scope_%d(self):\n' % ('    ' * level, level)
+
+    def line(self, slot, depth, needle):
+        return '%s%s = compute(%d)\n' % (
+                '    ' * depth,
+                self.name(slot, needle),
+                slot
+                )
+
+class JavaCorpus(Corpus):
+    EXTENSION = '.java'
+
+    def open_scope(self, section, level):
+        indent = '    ' * level
+        if level == 0:
+            return 'public class Section%d {\n' % section
+        elif level == self.depth - 1:
+            return '%spublic static void scope%d() {\n' % (indent, level)
+        return '%spublic static class Scope%d {\n' % (indent, level)
+
+    def close_scope(self, level):
+        return '%s}\n' % ('    ' * level)
+
+    def line(self, slot, depth, needle):
+        return '%sint %s = compute(%d);\n' % (
+                '    ' * depth,
+                self.name(slot, needle),
+                slot
+                )
+
+class GoCorpus(Corpus):
+    EXTENSION = '.go'
+
+    def open_scope(self, section, level):
+        indent = '\t' * level
+        if level == 0:
+            return 'func section%d() {\n' % section
+        return '%sscope%d := func() {\n' % (indent, level)
+
+    def close_scope(self, level):
+        return '%s}\n' % ('\t' * level)
+
+    def line(self, slot, depth, needle):
+        return '%s%s := compute(%d)\n' % (
+                '\t' * depth,
+                self.name(slot, needle),
+                slot
+                )
+
+class MarkdownCorpus(Corpus):
+    EXTENSION = '.md'
+
+    def open_scope(self, section, level):
+        return '%s Section %d.%d\n' % ('#' * (level + 1), section, level)
+
+    def line(self, slot, depth, needle):
+        return 'Some text about %s and more.\n' % self.name(slot, needle)
+
+CORPORA = {
+        'Python': PythonCorpus,
+        'Java': JavaCorpus,
+        'Go': GoCorpus,
+        'Markdown': MarkdownCorpus,
+        }
+
+def generate(root, reader_type, **kwargs):
+    """Write a synthetic tree of files for a reader under root (see Corpus
+    for the options). Returns the number of hits."""
+    return CORPORA[reader_type](**kwargs).write(root)
+
+class NullOutput(object):
+    """Swallows what publishers print."""
+    softspace = 0
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+def measure(func, setup=None, repeat=3):
+    """Time func (after calling setup, which isn't timed) repeat times.
+    Returns (best, mean) in seconds."""
+    times = []
+    for _ in xrange(repeat):
+        args = setup() if setup is not None else ()
+        began = time.time()
+        func(*args)
+        times.append(time.time() - began)
+
+    return min(times), sum(times) / len(times)
+
+def copy_tree(tree):
+    """A copy of a tree, set operations change the tree they're run on."""
+    data = StringIO()
+    tree.dump_binary(data)
+    return GrepTree.loads_binary(data.getvalue())
+
+def benchmarks(reader_cls):
+    """(name, func, setup) for everything timed against a corpus in the
+    current directory."""
+    config = make_config()
+    left = reader_cls(make_config(search_term=LEFT_QUERY)).build_tree(LEFT_QUERY)
+    right = reader_cls(make_config(search_term=RIGHT_QUERY)).build_tree(RIGHT_QUERY)
+
+    cases = []
+    for backend in Searcher.BACKENDS:
+        if backend == 'git' and not Searcher.in_git_work_tree():
+            # It would fall back to grep, which is timed already
+            continue
+        backend_config = make_config(backend=backend)
+        cases.append((
+                'reader/%s' % backend,
+                lambda c=backend_config: reader_cls(c).build_tree(QUERY),
+                None
+                ))
+        cases.append((
+                'searcher/%s' % backend,
+                lambda c=backend_config: list(
+                        Searcher(c, reader_cls.FILE_PATTERNS).search(QUERY)
+                        ),
+                None
+                ))
+
+    # The right hand side is whatever the reader would have searched for
+    set_config = make_config(search_term=RIGHT_QUERY)
+    def set_setup():
+        reader = reader_cls(set_config)
+        reader.tree = copy_tree(left)
+        reader.build_tree = lambda query, paths=None: copy_tree(right)
+        return (reader,)
+
+    for op in ['union', 'diff', 'exclude', 'inter', 'fast_inter',
+               'fast_exclude']:
+        cases.append((
+                'set_op/%s' % op,
+                lambda reader, op=op: getattr(reader, op)(),
+                set_setup
+                ))
+
+    for format_, publisher in sorted(GrepTools.VALID_FORMATS.iteritems()):
+        cases.append((
+                'publish/%s' % format_,
+                lambda p=publisher: publish(p(config), left),
+                None
+                ))
+
+    return cases
+
+def publish(pub, tree):
+    """Publish a tree without printing it."""
+    real_stdout = sys.stdout
+    sys.stdout = NullOutput()
+    try:
+        pub.publish(tree)
+    finally:
+        sys.stdout = real_stdout
+
+class in_corpus(object):
+    """Generate a corpus in a temporary directory and work inside it for
+    the duration of a with block. If git is True the corpus is added to a
+    new git repository so the git backend has something to work with."""
+
+    def __init__(self, reader_type, git=False, **kwargs):
+        self.reader_type = reader_type
+        self.git = git
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        self.cwd = os.getcwd()
+        self.root = mkdtemp(prefix='gtbench')
+        self.hits = generate(self.root, self.reader_type, **self.kwargs)
+        os.chdir(self.root)
+        if self.git:
+            init_git()
+        return self
+
+    def __exit__(self, *exc):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+def init_git():
+    """Add everything in the current directory to a new git repository, if
+    git is installed."""
+    try:
+        for cmd in [['git', 'init', '-q', '.'], ['git', 'add', '-A', '.']]:
+            subprocess.check_call(cmd)
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+def run(reader_types, corpus, repeat=3, only=None):
+    """Run the benchmarks for each reader, yields a result dict for each."""
+    for reader_type in reader_types:
+        reader_cls = READERS[reader_type]
+        with in_corpus(reader_type, git=True, **corpus) as env:
+            for name, func, setup in benchmarks(reader_cls):
+                if only and only not in name:
+                    continue
+                best, mean = measure(func, setup, repeat)
+                yield {
+                        'name': '%s/%s' % (reader_type, name),
+                        'params': dict(corpus, hits_total=env.hits),
+                        'best': best,
+                        'mean': mean,
+                        }
+
+# Each scaling check grows one option of the corpus, keeping the others as
+# they are, and times a reader searching it
+SCALING = {
+        'files': [25, 100, 400],
+        'hits': [20, 80, 320],
+        'depth': [4, 16, 64],
+        }
+
+def growth_exponent(sizes, times):
+    """k in times = c * sizes ** k, between the two largest sizes where fixed
+    costs (e.g. starting grep) matter least."""
+    return (math.log(max(times[-1], 1e-6) / max(times[-2], 1e-6)) /
+            math.log(float(sizes[-1]) / sizes[-2]))
+
+def scaling(reader_types, corpus, repeat=3):
+    """Time each reader as each option in SCALING grows, yields a result dict
+    for each with the fitted exponent and whether it's super-linear."""
+    for reader_type in reader_types:
+        reader_cls = READERS[reader_type]
+        for option, sizes in sorted(SCALING.iteritems()):
+            times = []
+            for size in sizes:
+                params = dict(corpus)
+                params[option] = size
+                if option == 'hits':
+                    params['lines'] = max(params['lines'], size * 2)
+                    params['files'] = min(params['files'], 10)
+                with in_corpus(reader_type, **params):
+                    config = make_config()
+                    best, _ = measure(
+                            lambda: reader_cls(config).build_tree(QUERY),
+                            repeat=repeat
+                            )
+                times.append(best)
+
+            exponent = growth_exponent(sizes, times)
+            yield {
+                    'name': '%s/scaling/%s' % (reader_type, option),
+                    'params': dict(corpus, sizes=sizes, times=times),
+                    'best': max(times),
+                    'exponent': exponent,
+                    'superlinear': exponent > SUPERLINEAR,
+                    }
+
+def current_commit():
+    """The commit greptools is running from, marked if there are changes that
+    aren't committed. Returns 'unknown' outside a git checkout."""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(
+                    ['git', 'rev-parse', '--short', 'HEAD'],
+                    cwd=cwd,
+                    stderr=devnull
+                    ).strip()
+            dirty = subprocess.call(
+                    ['git', 'diff', '--quiet', 'HEAD', '--', '.'],
+                    cwd=cwd,
+                    stderr=devnull
+                    )
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    return commit + ('-dirty' if dirty else '')
+
+def save(results, path):
+    """Append results to a json lines file."""
+    dir_path = os.path.dirname(path)
+    if dir_path and not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+
+    with open(path, 'a') as outp:
+        for result in results:
+            outp.write(json.dumps(result, sort_keys=True) + '\n')
+
+def load(path):
+    """All results saved at path."""
+    results = []
+    with open(path) as inp:
+        for line in inp:
+            if line.strip():
+                results.append(json.loads(line))
+
+    return results
+
+def compare(results, old, new):
+    """Returns (name, old best, new best) for every benchmark run on both
+    commits (the latest run of each). Commits can be given as prefixes."""
+    latest = {}
+    for result in results:
+        for commit in (old, new):
+            if result['commit'].startswith(commit):
+                latest[(commit, result['name'])] = result['best']
+
+    return [
+            (name, latest[(old, name)], latest[(new, name)])
+            for name in sorted(set(z[1] for z in latest))
+            if (old, name) in latest and (new, name) in latest
+            ]
+
+def print_result(result):
+    line = "%-40s %10.4fs" % (result['name'], result['best'])
+    if 'exponent' in result:
+        line += "  n^%.2f" % result['exponent']
+        if result['superlinear']:
+            line += "  \033[91mSUPER-LINEAR\033[0m"
+    print line
+
+def main(argv):
+    parser = ArgumentParser(description="Benchmark the greptools.")
+    parser.add_argument(
+            '-r',
+            '--reader',
+            action='append',
+            choices=sorted(READERS),
+            help="Reader to benchmark, can be repeated (default: all).",
+            dest='readers'
+            )
+    parser.add_argument('--files', default=50, type=int, dest='files',
+                        help="Number of files to generate.")
+    parser.add_argument('--depth', default=3, type=int, dest='depth',
+                        help="How deep scopes are nested.")
+    parser.add_argument('--hits', default=5, type=int, dest='hits',
+                        help="Hits per file.")
+    parser.add_argument('--lines', default=200, type=int, dest='lines',
+                        help="Roughly how many lines per file.")
+    parser.add_argument('--seed', default=0, type=int, dest='seed',
+                        help="Seed for generating files.")
+    parser.add_argument('--repeat', default=3, type=int, dest='repeat',
+                        help="Times to run each benchmark (the best counts).")
+    parser.add_argument('-k', default=None, type=str, dest='only',
+                        help="Only run benchmarks whose name contains this.")
+    parser.add_argument('--scaling', action='store_true', dest='scaling',
+                        help="Run scaling checks instead.")
+    parser.add_argument(
+            '--results',
+            default=os.path.join('.greptools', 'bench.jsonl'),
+            type=str,
+            help="Where results are saved and compared from.",
+            dest='results'
+            )
+    parser.add_argument('--save', action='store_true', dest='save',
+                        help="Save results, tagged with the current commit.")
+    parser.add_argument(
+            '--compare',
+            nargs=2,
+            default=None,
+            metavar=('OLD', 'NEW'),
+            help="Compare saved results of two commits instead of running.",
+            dest='compare'
+            )
+    config = parser.parse_args(argv[1:])
+
+    if config.compare:
+        rows = compare(load(config.results), *config.compare)
+        for name, old, new in rows:
+            print "%-40s %10.4fs %10.4fs %7.2fx" % (name, old, new, new / old)
+        return
+
+    corpus = {
+            'files': config.files,
+            'depth': config.depth,
+            'hits': config.hits,
+            'lines': config.lines,
+            'seed': config.seed,
+            }
+    readers = config.readers or sorted(READERS)
+    if config.scaling:
+        results = scaling(readers, corpus, config.repeat)
+    else:
+        results = run(readers, corpus, config.repeat, config.only)
+
+    commit = current_commit()
+    collected = []
+    for result in results:
+        result['commit'] = commit
+        result['time'] = time.time()
+        print_result(result)
+        collected.append(result)
+
+    if config.save:
+        save(collected, config.results)
+
+if __name__ == "__main__":
+    main(sys.argv)
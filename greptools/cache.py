@@ -0,0 +1,211 @@
+"""On-disk caches kept under `.greptools/` in the directory being searched."""
+import marshal
+import os
+import os.path
+import time
+
+from cStringIO import StringIO
+from hashlib import sha1
+from tempfile import NamedTemporaryFile
+
+from greptools import stats
+from greptools.greptree import GrepTree
+from greptools.outline import Outline
+
+CACHE_DIR = '.greptools'
+
+# Files modified this recently can't be trusted to keep their fingerprint,
+# another change within the resolution of the filesystem's mtime would go
+# unnoticed
+MIN_AGE = 2.0
+
+def fingerprint(stat):
+    """The parts of os.stat() used to decide if a file has changed."""
+    return [stat.st_size, stat.st_mtime]
+
+def write_atomic(path, data):
+    """Write data to a file without readers ever seeing it half written."""
+    with NamedTemporaryFile(
+            dir=os.path.dirname(path),
+            prefix='.tmp',
+            delete=False
+            ) as outp:
+        outp.write(data)
+    os.rename(outp.name, path)
+
+class OutlineCache(object):
+    """Stores the Outline of each file, keyed by path, size and mtime.
+
+    There is one small marshalled file per entry, so several processes can
+    read and write the cache at the same time. Long running processes can
+    keep outlines in memory as well (see keep_in_memory()), in which case
+    disk can be False to only use memory."""
+    SUBDIR = 'outlines'
+
+    # Outlines of every reader, keyed by (key, abspath), once enabled
+    _memory = None
+
+    def __init__(self, key, root=CACHE_DIR, disk=True):
+        self.key = key
+        self.path = os.path.join(root, self.SUBDIR)
+        self.disk = disk
+
+    @classmethod
+    def keep_in_memory(cls):
+        """Keep outlines in memory for the rest of this process's life."""
+        if cls._memory is None:
+            cls._memory = {}
+
+    @classmethod
+    def in_memory(cls):
+        """Are outlines being kept in memory?"""
+        return cls._memory is not None
+
+    def _entry_path(self, file_path):
+        digest = sha1('%s\0%s' % (self.key, os.path.abspath(file_path)))
+        return os.path.join(self.path, digest.hexdigest())
+
+    def get(self, file_path, stat):
+        """Returns the cached Outline of a file or None if it's stale."""
+        outline = self._get(file_path, stat)
+        stats.count('outline_cache_misses' if outline is None
+                    else 'outline_cache_hits')
+        return outline
+
+    def _get(self, file_path, stat):
+        abspath = os.path.abspath(file_path)
+        if self._memory is not None:
+            entry = self._memory.get((self.key, abspath))
+            if entry is not None and entry[0] == fingerprint(stat):
+                return entry[1]
+
+        if not self.disk:
+            return None
+
+        try:
+            with open(self._entry_path(file_path), 'rb') as inp:
+                path, print_, scopes = marshal.load(inp)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+
+        if path != abspath or print_ != fingerprint(stat):
+            return None
+
+        outline = Outline(scopes)
+        if self._memory is not None:
+            self._memory[(self.key, abspath)] = (print_, outline)
+
+        return outline
+
+    def put(self, file_path, stat, outline):
+        """Save the Outline of a file."""
+        if time.time() - stat.st_mtime < MIN_AGE:
+            return
+
+        abspath = os.path.abspath(file_path)
+        if self._memory is not None:
+            self._memory[(self.key, abspath)] = (fingerprint(stat), outline)
+
+        if not self.disk:
+            return
+
+        entry = (
+                abspath,
+                fingerprint(stat),
+                outline.to_list(),
+                )
+
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            pass
+
+        try:
+            write_atomic(self._entry_path(file_path), marshal.dumps(entry))
+        except (IOError, OSError):
+            pass
+
+def tree_fingerprint(paths, min_age=MIN_AGE):
+    """A digest of the path, size and mtime of every file in paths. Returns
+    None if any of them were modified too recently to be sure of."""
+    now = time.time()
+    digest = sha1()
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if now - stat.st_mtime < min_age:
+            return None
+        digest.update('%s\0%r\0' % (path, fingerprint(stat)))
+
+    return digest.hexdigest()
+
+class ResultCache(object):
+    """Stores the GrepTree of each search, in the binary format, keyed by
+    everything that could change it (see BaseReader.result_key()).
+
+    Entries are evicted least recently used first once they take up more than
+    MAX_BYTES. An entry's mtime is bumped whenever it's used."""
+    SUBDIR = 'results'
+    MAX_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, root=CACHE_DIR, max_bytes=None):
+        self.path = os.path.join(root, self.SUBDIR)
+        self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, sha1(key).hexdigest())
+
+    def get(self, key):
+        """Returns the cached GrepTree for key or None."""
+        path = self._entry_path(key)
+        try:
+            tree = GrepTree.load_path(path)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            stats.count('result_cache_misses')
+            return None
+
+        stats.count('result_cache_hits')
+        return tree
+
+    def put(self, key, tree):
+        """Save the GrepTree for key, evicting old entries if needed."""
+        data = StringIO()
+        tree.dump_binary(data)
+
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            pass
+
+        try:
+            write_atomic(self._entry_path(key), data.getvalue())
+            self.evict()
+        except (IOError, OSError):
+            pass
+
+    def evict(self):
+        """Remove the least recently used entries until the rest fit into
+        max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+            total += stat.st_size
+
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,145 @@
+"""Thin client for a greptools server (see greptools.server).
+
+This only imports what it needs to talk to the server so the scripts in bin/
+start quickly when there's a server running."""
+import marshal
+import os
+import os.path
+import socket
+import stat
+import struct
+import sys
+import tempfile
+
+from threading import Thread
+
+# Requests and responses are marshalled and prefixed with their length
+_LENGTH = struct.Struct('<I')
+
+# Most of stdin to send in one message
+CHUNK_SIZE = 64 * 1024
+
+def socket_path():
+    """Where the server for this user listens, $GREPTOOLS_SOCKET overrides
+    the default."""
+    return os.environ.get('GREPTOOLS_SOCKET') or os.path.join(
+            tempfile.gettempdir(),
+            'greptools-%d.sock' % os.getuid()
+            )
+
+def send_message(sock, data):
+    """Marshal data and send it through a socket."""
+    data = marshal.dumps(data)
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+def recv_message(sock):
+    """Receive and unmarshal data sent by send_message()."""
+    length, = _LENGTH.unpack(recv_exactly(sock, _LENGTH.size))
+    return marshal.loads(recv_exactly(sock, length))
+
+def recv_exactly(sock, size):
+    """Read exactly size bytes from a socket."""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError("Connection closed early")
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return ''.join(chunks)
+
+def send_input(sock, inp):
+    """Send what's on inp through a socket in {'stdin': chunk} messages as
+    it arrives, then an empty chunk to mark the end."""
+    if hasattr(inp, 'fileno'):
+        # file.read() would wait for a whole chunk
+        fd = inp.fileno()
+        read = lambda: os.read(fd, CHUNK_SIZE)
+    else:
+        read = lambda: inp.read(CHUNK_SIZE)
+
+    try:
+        while True:
+            chunk = read()
+            send_message(sock, {'stdin': chunk})
+            if not chunk:
+                break
+    except (IOError, OSError):
+        # The server isn't listening any more (socket.error is an IOError)
+        pass
+
+def is_own_socket(path):
+    """Is path a socket that belongs to this user? Anyone can create the
+    default path in /tmp before our server does, and they'd be sent our
+    searches."""
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+def connect(path=None):
+    """Connect to a running server, returns None if there isn't one (or the
+    socket isn't ours)."""
+    path = socket_path() if path is None else path
+    if not is_own_socket(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+
+    return sock
+
+def search_remote(reader_name, argv, path=None, stdin=None, stdout=None,
+                  stderr=None):
+    """
+    Have a running server do the work of a greptool and write it's output to
+    stdout and stderr as it arrives. stdin is sent on while that's happening.
+    Returns the status the greptool exited with, or None if there's no server
+    that can do it (then stdin hasn't been read).
+    """
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+    stderr = sys.stderr if stderr is None else stderr
+
+    sock = connect(path)
+    if sock is None:
+        return None
+
+    try:
+        send_message(sock, {'reader': reader_name})
+        if not recv_message(sock)['known']:
+            return None
+
+        stdin_tty = stdin.isatty()
+        send_message(sock, {
+                'argv': list(argv),
+                'cwd': os.getcwd(),
+                'stdin_tty': stdin_tty,
+                'stdout_tty': stdout.isatty(),
+                'stderr_tty': stderr.isatty(),
+                })
+        if not stdin_tty:
+            sender = Thread(target=send_input, args=(sock, stdin))
+            sender.daemon = True
+            sender.start()
+
+        while True:
+            message = recv_message(sock)
+            if 'status' in message:
+                return message['status']
+            for name, outp in (('stdout', stdout), ('stderr', stderr)):
+                if name in message:
+                    outp.write(message[name])
+                    outp.flush()
+    except (socket.error, EOFError, ValueError), err:
+        stderr.write("Whoops, lost the greptools server: %s\n" % err)
+        return 1
+    finally:
+        sock.close()
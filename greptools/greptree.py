@@ -4,9 +4,32 @@ is a nested tree style collection of these contexts, with the furthest point on
 each branch containing a list of lines that come from that context.
 """
 import json
+import struct
+from array import array
+
+from greptools import stats
+
+# Compact binary format used to pass trees between greptools through a pipe.
+# After a header, it's a series of records:
+# - S: a string (context or file path), the n-th one has id n
+# - N: a node, given the id of it's parent node (root is 0) and it's key
+# - L: a line in a node, given the node id, line number and text
+# - T: the search stopped early at a limit, so there may be more lines (since
+#   version 2, older greptools would choke on it)
+# - E: the end of the tree
+MAGIC = '\x00GT'
+VERSION = 2
+READ_VERSIONS = (1, 2)
+_HEADER = struct.Struct('<3sB')
+_STRING = struct.Struct('<cI')
+_NODE = struct.Struct('<cII')
+_LINE = struct.Struct('<cIiI')
 
 def count_lines(subtree):
     """Convienience function to count the number of lines in a subtree."""
+    if isinstance(subtree, GrepNode):
+        return subtree.count
+
     count = 0
     for key, val in subtree.iteritems():
         if key == 'lines':
@@ -16,24 +39,203 @@ def count_lines(subtree):
 
     return count
 
+def to_utf8(text):
+    """Text loaded from json is unicode, everything else in a tree is utf-8
+    encoded str. Mixing them breaks sorting and comparing keys."""
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+def intern_key(key):
+    """Contexts repeat a lot between files, so only keep one copy of each."""
+    return intern(key) if type(key) is str else key
+
+class GrepNode(object):
+    """A single context in a GrepTree.
+
+    The lines directly in this context are stored as an array of line numbers
+    and a list of line texts. Count is the total number of lines in this node
+    and all of it's descendants, it's kept up to date by GrepTree."""
+    __slots__ = ('children', 'numbers', 'texts', 'count')
+
+    def __init__(self):
+        self.children = {}
+        self.numbers = None
+        self.texts = None
+        self.count = 0
+
+    def child(self, key):
+        """Returns the child node for a context, creating it if needed."""
+        node = self.children.get(key)
+        if node is None:
+            node = self.children[intern_key(key)] = GrepNode()
+            stats.count('tree_nodes')
+
+        return node
+
+    def add_line(self, line_number, line_text):
+        """Store a line in this node. Doesn't touch count."""
+        if self.numbers is None:
+            self.numbers = array('l')
+            self.texts = []
+        self.numbers.append(line_number)
+        self.texts.append(line_text)
+
+    def lines(self):
+        """List of (line_number, line_text) directly in this node."""
+        if self.numbers is None:
+            return []
+
+        return zip(self.numbers, self.texts)
+
+    def filter(self, keep):
+        """Drop the lines in this node and it's descendants whose text keep()
+        is false for, along with any children left empty. Works bottom-up in
+        a single pass and returns the new count."""
+        count = 0
+        if self.texts is not None:
+            kept = [z for z in zip(self.numbers, self.texts) if keep(z[1])]
+            if len(kept) != len(self.texts):
+                self.numbers = array('l', [z[0] for z in kept])
+                self.texts = [z[1] for z in kept]
+            count = len(kept)
+
+        for key, node in self.children.items():
+            if node.filter(keep):
+                count += node.count
+            else:
+                del self.children[key]
+
+        self.count = count
+        return count
+
+    def recount(self):
+        """Work out count for this node and all of it's descendants."""
+        self.count = len(self.texts) if self.texts is not None else 0
+        for node in self.children.itervalues():
+            self.count += node.recount()
+
+        return self.count
+
+    def to_dict(self):
+        """Convert to nested dicts, as used in the JSON format."""
+        data = {}
+        for key, node in self.children.iteritems():
+            data[key] = node.to_dict()
+        if self.numbers is not None:
+            data[GrepTree.LINES] = self.lines()
+
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a node (and it's descendants) from nested dicts, keys and
+        texts are stored as utf-8 (see to_utf8())."""
+        node = cls()
+        stats.count('tree_nodes')
+        for key, val in data.iteritems():
+            if key == GrepTree.LINES:
+                node.numbers = array('l')
+                node.texts = []
+                for line_number, line_text in val:
+                    node.add_line(line_number, to_utf8(line_text))
+                node.count += len(val)
+            else:
+                child = cls.from_dict(val)
+                node.children[intern_key(to_utf8(key))] = child
+                node.count += child.count
+
+        return node
+
 class GrepTree(object):
     """Data structure for storing results as a tree of nested contexts."""
     LINES = 'lines'
 
-    def __init__(self, data={}):
-        self.data = data
-        self._count = 0
+    def __init__(self, data=None):
+        if data:
+            self.root = GrepNode.from_dict(data)
+        else:
+            self.root = GrepNode()
+
+        # Did the search that found these lines stop at a limit?
+        self.truncated = False
+
+    @property
+    def data(self):
+        """The tree as nested dicts, the way it's stored as JSON."""
+        return self.root.to_dict()
+
+    @data.setter
+    def data(self, data):
+        self.root = GrepNode.from_dict(data)
+
+    @property
+    def _count(self):
+        """Total number of lines in the tree."""
+        return self.root.count
 
     @classmethod
     def load(cls, inp_file):
-        """Create GrepTree object from json file handler."""
-        return cls(json.load(inp_file))
+        """Create GrepTree object from a file handler in either the binary
+        or json format."""
+        data = inp_file.read()
+        if data.startswith(MAGIC):
+            return cls.loads_binary(data)
+        else:
+            return cls(json.loads(data))
 
     @classmethod
     def load_path(cls, path):
-        """Open json file as GrepTree object."""
-        with open(path, 'r') as inp_file:
-            return cls(json.load(inp_file))
+        """Open json or binary file as GrepTree object."""
+        with open(path, 'rb') as inp_file:
+            return cls.load(inp_file)
+
+    @classmethod
+    def loads_binary(cls, data):
+        """Create GrepTree object from a string in the binary format."""
+        try:
+            magic, version = _HEADER.unpack_from(data)
+            if magic != MAGIC or version not in READ_VERSIONS:
+                raise ValueError("Unsupported format version %d" % version)
+
+            tree = cls()
+            nodes = [tree.root]
+            strings = []
+            offset = _HEADER.size
+            while True:
+                tag = data[offset]
+                if tag == 'L':
+                    _, node_id, line_number, length = _LINE.unpack_from(
+                            data,
+                            offset
+                            )
+                    offset += _LINE.size
+                    nodes[node_id].add_line(
+                            line_number,
+                            data[offset:offset + length]
+                            )
+                    offset += length
+                elif tag == 'N':
+                    _, parent_id, string_id = _NODE.unpack_from(data, offset)
+                    offset += _NODE.size
+                    nodes.append(nodes[parent_id].child(strings[string_id]))
+                elif tag == 'S':
+                    _, length = _STRING.unpack_from(data, offset)
+                    offset += _STRING.size
+                    strings.append(intern_key(data[offset:offset + length]))
+                    offset += length
+                elif tag == 'T':
+                    tree.truncated = True
+                    offset += 1
+                elif tag == 'E':
+                    break
+                else:
+                    raise ValueError("Unknown record type %r" % tag)
+        except (struct.error, IndexError), err:
+            raise ValueError("Truncated tree: %s" % err)
+
+        tree.root.recount()
+        return tree
 
     def dump_to_path(self, path):
         """JSON encode GrepTree object and write to file at path."""
@@ -45,63 +247,172 @@ class GrepTree(object):
         flat = json.dumps(self.data, indent=4)
         outp_file.write(flat)
 
+    def dump_binary(self, outp_file):
+        """Encode GrepTree object in the binary format and write to file
+        object."""
+        chunks = [_HEADER.pack(MAGIC, VERSION)]
+        strings = {}
+
+        def string_id(text):
+            text = to_utf8(text)
+            sid = strings.get(text)
+            if sid is None:
+                sid = strings[text] = len(strings)
+                chunks.append(_STRING.pack('S', len(text)))
+                chunks.append(text)
+            return sid
+
+        next_id = 1
+        stack = [(0, self.root)]
+        while stack:
+            parent_id, parent = stack.pop()
+            for key, node in parent.children.iteritems():
+                chunks.append(_NODE.pack('N', parent_id, string_id(key)))
+                node_id = next_id
+                next_id += 1
+
+                for line_number, line_text in node.lines():
+                    line_text = to_utf8(line_text)
+                    chunks.append(_LINE.pack(
+                            'L',
+                            node_id,
+                            line_number,
+                            len(line_text)
+                            ))
+                    chunks.append(line_text)
+
+                stack.append((node_id, node))
+
+        if self.truncated:
+            chunks.append('T')
+        chunks.append('E')
+        outp_file.write(''.join(chunks))
+
+    def keys(self):
+        """
+        Yields a (path, line_number, line_text) key for every line in the
+        tree, where path is a tuple of the contexts leading to it (starting
+        with the file). Keys come out sorted, without having to sort them all
+        at once, by visiting children in order after a node's own lines.
+        """
+        stack = [((), self.root)]
+        while stack:
+            path, node = stack.pop()
+            if node.numbers is not None and path:
+                for line_number, line_text in sorted(node.lines()):
+                    yield path, line_number, line_text
+
+            for key in sorted(node.children, reverse=True):
+                stack.append((path + (key,), node.children[key]))
+
+    @classmethod
+    def from_keys(cls, keys):
+        """Create GrepTree object from keys in the form yielded by keys().
+        Lines are added in the order they come."""
+        tree = cls()
+        last_path = None
+        for path, line_number, line_text in keys:
+            if path != last_path:
+                node = tree.touch_path(path)
+                last_path = path
+            node.add_line(line_number, line_text)
+
+        tree.root.recount()
+        return tree
+
     def touch(self, key, subtree=None):
         """Add empty node to a subtree."""
         if subtree is None:
-            subtree = self.data
-        return subtree.setdefault(key, {})
+            subtree = self.root
+        return subtree.child(key)
 
     def touch_path(self, path, subtree=None):
-        """Recursively adds a string of empty nodes to a subtree. 
+        """Recursively adds a string of empty nodes to a subtree.
         Returns the new subtree when it's done."""
+        if subtree is None:
+            subtree = self.root
         for step in path:
-            subtree = self.touch(step, subtree)
+            subtree = subtree.child(step)
 
         return subtree
 
+    def _node_path(self, path):
+        """List of nodes from the root to the end of path (inclusive), or
+        None if the path doesn't exist."""
+        nodes = [self.root]
+        for step in path:
+            node = nodes[-1].children.get(step)
+            if node is None:
+                return None
+            nodes.append(node)
+
+        return nodes
+
+    def remove(self, key):
+        """Remove a top level node (e.g. a file) along with all of it's lines."""
+        node = self.root.children.pop(key, None)
+        if node is not None:
+            self.root.count -= node.count
+
     def append(self, file_path, line_number, line_text, cntx_list):
         """
         Adds a line to the tree creating any intermediate nodes along the way.
         """
-        # Step through context tree, creating nodes along the way
-        node_path = [file_path] + list(cntx_list)
-        head = self.touch_path(node_path)
+        # Step through context tree, creating nodes along the way and
+        # incrementing their counters
+        head = self.root
+        head.count += 1
+        head = head.child(file_path)
+        head.count += 1
+        for cntx in cntx_list:
+            head = head.child(cntx)
+            head.count += 1
 
         # Add line_number + line_text to head of path
-        lines = head.setdefault(self.LINES, [])
-        lines.append((line_number, line_text))
-
-        # Increment counter
-        self._count += 1
+        head.add_line(line_number, line_text)
 
-    def walk(self, tree=None, kpath=None):
-        """Traverses a GrepTree, yielding node details along the way."""
+    def walk_nodes(self, tree=None, kpath=None):
+        """Traverses a GrepTree, yielding the path to and node of each context."""
         if tree is None:
-            tree = self.data
+            tree = self.root
         if kpath is None:
             kpath = []
 
-        for key, val in tree.iteritems():
-            if isinstance(val, dict):
-                new_kpath = kpath + [key]
-                yield new_kpath, val.get(GrepTree.LINES, [])
-                for sub_kpath, lines in self.walk(val, new_kpath):
-                    yield sub_kpath, lines
-            elif isinstance(val, list):
-                pass
-            else:
-                print "%s type found: %s" % (type(val), val)
+        for key, node in tree.children.iteritems():
+            new_kpath = kpath + [key]
+            yield new_kpath, node
+            for sub_kpath, sub_node in self.walk_nodes(node, new_kpath):
+                yield sub_kpath, sub_node
 
-    def prune(self, path):
-        if count_lines(self.touch_path(path)) == 0:
-            # access path's parent node
-            subtree = self.touch_path(path[:-1])
+    def walk(self, tree=None, kpath=None):
+        """Traverses a GrepTree, yielding node details along the way."""
+        for kpath, node in self.walk_nodes(tree, kpath):
+            yield kpath, node.lines()
 
-            # delete node at path
-            if not subtree:
-                subtree = self.data
-            del subtree[path[-1]]
+    def filter(self, keep):
+        """Keep only the lines whose text keep() is true for, dropping any
+        contexts left empty. Returns the number of lines left."""
+        return self.root.filter(keep)
+
+    def prune(self, path):
+        """Remove the node at path if there are no lines in it."""
+        nodes = self._node_path(path)
+        if nodes is not None and nodes[-1].count == 0:
+            del nodes[-2].children[path[-1]]
 
     def set_lines(self, path, lines):
-        subtree = self.touch_path(path)
-        subtree[self.LINES] = lines
+        """Replace the lines directly in the node at path."""
+        nodes = self._node_path(path)
+        if nodes is None:
+            self.touch_path(path)
+            nodes = self._node_path(path)
+
+        node = nodes[-1]
+        delta = len(lines) - len(node.texts or [])
+        node.numbers = array('l')
+        node.texts = []
+        for line_number, line_text in lines:
+            node.add_line(line_number, line_text)
+
+        for node in nodes:
+            node.count += delta
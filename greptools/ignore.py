@@ -0,0 +1,203 @@
+"""Matching paths against the rules in .gitignore style files."""
+import os
+import os.path
+import re
+import stat
+import time
+
+from greptools.cache import MIN_AGE, fingerprint
+
+def translate(pattern):
+    """Convert a gitignore glob into a regex (without anchors)."""
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        char = pattern[i]
+        i += 1
+        if char == '*':
+            if pattern[i:i + 1] == '*':
+                # '**/' matches any number of directories, a trailing '/**'
+                # matches everything inside a directory
+                if pattern[i + 1:i + 2] == '/':
+                    res.append('(?:.*/)?')
+                    i += 2
+                else:
+                    res.append('.*')
+                    i += 1
+            else:
+                res.append('[^/]*')
+        elif char == '?':
+            res.append('[^/]')
+        elif char == '[':
+            # A ']' straight after the (possibly negated) '[' is literal
+            start = i
+            if start < n and pattern[start] in '!^':
+                start += 1
+            if start < n and pattern[start] == ']':
+                start += 1
+            end = pattern.find(']', start)
+            if end == -1:
+                res.append('\\[')
+            else:
+                body = pattern[i:end].replace('\\', '\\\\')
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                res.append('[%s]' % body)
+                i = end + 1
+        elif char == '\\' and i < n:
+            res.append(re.escape(pattern[i]))
+            i += 1
+        else:
+            res.append(re.escape(char))
+
+    return ''.join(res)
+
+class IgnoreRule(object):
+    """A single line from an ignore file."""
+
+    def __init__(self, pattern):
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+
+        # Patterns containing a slash are relative to the ignore file,
+        # otherwise they match a file or directory name at any depth
+        self.anchored = '/' in pattern
+        self.regex = re.compile(translate(pattern.lstrip('/')) + r'\Z')
+
+    def match(self, rel_path, name, is_dir):
+        """Does this rule apply to a path (relative to the ignore file)?"""
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            return self.regex.match(rel_path) is not None
+        else:
+            return self.regex.match(name) is not None
+
+class IgnoreRules(object):
+    """All the rules from one ignore file. base is the directory the file is
+    in, relative to the top of the search (with no leading './')."""
+
+    def __init__(self, base, lines):
+        self.base = base
+        self.rules = []
+        for line in lines:
+            line = line.rstrip('\r\n')
+
+            # Trailing spaces are ignored unless they're escaped
+            if not line.endswith('\\ '):
+                line = line.rstrip(' ')
+
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('\\#') or line.startswith('\\!'):
+                line = line[1:]
+
+            self.rules.append(IgnoreRule(line))
+
+    # Files already read by this process, keyed by (abspath, base)
+    _loaded = {}
+
+    @classmethod
+    def from_file(cls, path, base=''):
+        """Read rules from a file, returns None if it can't be read. Files
+        this process has already read aren't read again unless they've
+        changed (which matters for long running processes)."""
+        try:
+            stat = os.stat(path)
+            key = (os.path.abspath(path), base)
+            entry = cls._loaded.get(key)
+            if entry is not None and entry[0] == fingerprint(stat):
+                return entry[1]
+
+            with open(path) as inp:
+                rules = cls(base, inp.readlines())
+        except (IOError, OSError):
+            return None
+
+        if time.time() - stat.st_mtime >= MIN_AGE:
+            cls._loaded[key] = (fingerprint(stat), rules)
+
+        return rules
+
+    def match(self, rel_path, is_dir):
+        """Returns True if the path is ignored, False if it's explicitly
+        included (negated) and None if no rule in this file applies."""
+        if self.base:
+            rel_path = rel_path[len(self.base) + 1:]
+        name = rel_path.rsplit('/', 1)[-1]
+
+        # The last matching rule wins
+        for rule in reversed(self.rules):
+            if rule.match(rel_path, name, is_dir):
+                return not rule.negate
+
+        return None
+
+def is_ignored(rule_sets, rel_path, is_dir):
+    """Check a path against the rules of every ignore file that applies to it.
+    Rules from deeper ignore files take precedence."""
+    for rules in reversed(rule_sets):
+        result = rules.match(rel_path, is_dir)
+        if result is not None:
+            return result
+
+    return False
+
+def is_readable_file(path):
+    """Is path (or what it links to) a regular file that we can read?"""
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        # Dangling symlinks and the like
+        return False
+
+    return stat.S_ISREG(mode) and os.access(path, os.R_OK)
+
+def walk_files(top, ignore_file=None, nested_name=None, always_skip=()):
+    """Walk the tree under top once, yielding the paths of files that aren't
+    ignored. Ignored directories aren't descended into, and anything that
+    isn't a readable regular file is skipped.
+
+    - ignore_file : rules applied from the top of the tree.
+    - nested_name : ignore files with this name in sub directories are
+                    applied to everything below them.
+    - always_skip : names of directories that are never searched."""
+    rules_for = {top: []}
+    if ignore_file is not None:
+        rules = IgnoreRules.from_file(ignore_file)
+        if rules is not None:
+            rules_for[top].append(rules)
+
+    for dirpath, dirnames, filenames in os.walk(top):
+        rule_sets = rules_for.pop(dirpath)
+        rel_dir = os.path.relpath(dirpath, top)
+        rel_dir = '' if rel_dir == '.' else rel_dir.replace(os.sep, '/')
+
+        if rel_dir and nested_name and nested_name in filenames:
+            rules = IgnoreRules.from_file(
+                    os.path.join(dirpath, nested_name),
+                    rel_dir
+                    )
+            if rules is not None:
+                rule_sets = rule_sets + [rules]
+
+        prefix = rel_dir + '/' if rel_dir else ''
+        kept = []
+        for dirname in sorted(dirnames):
+            if dirname in always_skip:
+                continue
+            if not is_ignored(rule_sets, prefix + dirname, True):
+                kept.append(dirname)
+                rules_for[os.path.join(dirpath, dirname)] = rule_sets
+        dirnames[:] = kept
+
+        for filename in sorted(filenames):
+            if is_ignored(rule_sets, prefix + filename, False):
+                continue
+            path = os.path.join(dirpath, filename)
+            if is_readable_file(path):
+                yield path
@@ -0,0 +1,250 @@
+"""A trigram index of the files under the current directory, kept under
+`.greptools/`. For each three character string it lists the files that contain
+it, so a search only has to look at files containing every trigram that any
+match must contain.
+"""
+import marshal
+import os
+import os.path
+import re
+import time
+
+from array import array
+from hashlib import sha1
+
+from greptools.cache import CACHE_DIR, MIN_AGE, fingerprint, write_atomic
+
+# Characters with a special meaning in either grep's or python's regex syntax
+SPECIAL = '.[]*+?{}()^$|\\'
+
+# Escaped characters that are literal in both syntaxes
+LITERAL_ESCAPES = '.[]*^$\\/-'
+
+# Escapes that take the characters after them with them (\x41, \u00e9, \N{...},
+# octal and back references), there's no telling where they end
+NUMERIC_ESCAPES = 'xuUN0123456789'
+
+# Python's inline flags, (?x) makes whitespace and '#' mean something else
+INLINE_FLAGS = re.compile(r'\(\?[iLmsux]')
+
+def required_trigrams(exp):
+    """Returns the (lowercase) trigrams that any line matching exp must
+    contain, or None if the expression can't be narrowed down that way.
+
+    This only looks at runs of plain characters outside of groups so it works
+    for both grep's and python's syntax. It's conservative, e.g. anything with
+    alternation, numeric escapes or inline flags gives None."""
+    if '|' in exp or INLINE_FLAGS.search(exp):
+        return None
+
+    runs = []
+    run = []
+    depth = 0
+    i, n = 0, len(exp)
+    while i < n:
+        char = exp[i]
+        i += 1
+        if char == '\\' and i < n:
+            char = exp[i]
+            i += 1
+            if char in LITERAL_ESCAPES and not depth:
+                run.append(char)
+                continue
+            elif char in NUMERIC_ESCAPES:
+                return None
+            elif char in '?+':
+                # \? and \+ are repetition in grep's syntax, \+ needs the
+                # character before but it's simpler to drop it too
+                char = '?'
+            elif char not in '(){':
+                # Anything else (\w, \b, ...) ends the run
+                char = '\\'
+
+            # \( \) and \{ are grouping and repetition in grep's syntax, so
+            # they're treated like ( ) and { below to be safe
+
+        if char in '*?{':
+            # The character before is optional
+            if run:
+                run.pop()
+            if char == '{':
+                end = exp.find('}', i)
+                i = n if end == -1 else end + 1
+        elif char == '[':
+            # Skip the whole class, a ']' straight after '[' or '[^' is literal
+            if exp[i:i + 1] == '^':
+                i += 1
+            if exp[i:i + 1] == ']':
+                i += 1
+            end = exp.find(']', i)
+            i = n if end == -1 else end + 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char not in SPECIAL and char < '\x80' and not depth:
+            # Only ASCII, grep -i might fold the case of other characters
+            run.append(char)
+            continue
+
+        runs.append(''.join(run))
+        run = []
+    runs.append(''.join(run))
+
+    trigrams = set()
+    for run in runs:
+        run = run.lower()
+        trigrams.update(run[z:z + 3] for z in xrange(len(run) - 2))
+
+    return trigrams or None
+
+def file_trigrams(path):
+    """The set of (lowercase) trigrams in a file. Returns an empty set for
+    binary or unreadable files because grep won't match anything in them."""
+    try:
+        with open(path, 'rb') as inp:
+            data = inp.read()
+    except IOError:
+        return set()
+
+    if '\x00' in data:
+        return set()
+
+    data = data.lower()
+    return set(data[z:z + 3] for z in xrange(len(data) - 2))
+
+class TrigramIndex(object):
+    """Posting lists of the files containing each trigram.
+
+    Files are identified by their position in `files`, `prints` holds the
+    fingerprint of each file when it was indexed. Files that weren't indexed
+    or have changed since are always searched."""
+    SUBDIR = 'index'
+
+    # Indexes already read by this process, keyed by path
+    _loaded = {}
+
+    def __init__(self, key, root=CACHE_DIR):
+        self.path = os.path.join(
+                root,
+                self.SUBDIR,
+                sha1(key).hexdigest()
+                )
+        self.files = []
+        self.prints = []
+        self.postings = {}
+        self.loaded = self.load()
+
+    def load(self):
+        """Read the index from disk, returns False if there isn't one. It's
+        only read again by the same process if it's changed since."""
+        try:
+            print_ = fingerprint(os.stat(self.path))
+            entry = self._loaded.get(self.path)
+            if entry is not None and entry[0] == print_:
+                files, prints, postings = entry[1]
+            else:
+                with open(self.path, 'rb') as inp:
+                    files, prints, postings = marshal.load(inp)
+                self._loaded[self.path] = (print_, (files, prints, postings))
+        except (OSError, IOError, EOFError, ValueError, TypeError):
+            return False
+
+        self.files = files
+        self.prints = prints
+        self.postings = postings
+        return True
+
+    def save(self):
+        """Write the index to disk."""
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError:
+            pass
+
+        data = (self.files, self.prints, self.postings)
+        write_atomic(self.path, marshal.dumps(data))
+
+    def update(self, paths):
+        """Index paths, only reading the files that are new or have changed
+        since they were last indexed. Returns the number of files read."""
+        old_ids = dict((z, i) for i, z in enumerate(self.files))
+        files = []
+        prints = []
+        remap = {}
+        fresh = []
+
+        now = time.time()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime < MIN_AGE:
+                continue
+
+            indx = old_ids.get(path)
+            new_id = len(files)
+            files.append(path)
+            prints.append(fingerprint(stat))
+            if indx is not None and self.prints[indx] == prints[-1]:
+                remap[indx] = new_id
+            else:
+                fresh.append(new_id)
+
+        # Keep the postings of files that haven't changed
+        postings = {}
+        for trigram, posting in self.postings.iteritems():
+            kept = array('I', [
+                    remap[z] for z in array('I', posting) if z in remap
+                    ])
+            if kept:
+                postings[trigram] = kept
+
+        for new_id in fresh:
+            for trigram in file_trigrams(files[new_id]):
+                posting = postings.get(trigram)
+                if posting is None:
+                    posting = postings[trigram] = array('I')
+                posting.append(new_id)
+
+        self.files = files
+        self.prints = prints
+        self.postings = dict(
+                (z, posting.tostring()) for z, posting in postings.iteritems()
+                )
+
+        return len(fresh)
+
+    def narrow(self, paths, trigrams):
+        """Yields the paths that could contain all of trigrams. Paths that
+        aren't in the index or have changed since are always included."""
+        if trigrams is None:
+            for path in paths:
+                yield path
+            return
+
+        # Start with the shortest posting lists
+        postings = sorted(
+                [self.postings.get(z, '') for z in trigrams],
+                key=len
+                )
+        ids = set(array('I', postings[0]))
+        for posting in postings[1:]:
+            if not ids:
+                break
+            ids.intersection_update(array('I', posting))
+
+        indexed = dict((z, i) for i, z in enumerate(self.files))
+        for path in paths:
+            indx = indexed.get(path)
+            if indx is None or indx in ids:
+                yield path
+                continue
+
+            try:
+                print_ = fingerprint(os.stat(path))
+            except OSError:
+                continue
+            if print_ != self.prints[indx]:
+                yield path
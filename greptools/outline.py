@@ -0,0 +1,83 @@
+"""An outline is the list of named scopes (classes, functions, headers, etc.)
+in a file along with the range of lines each one covers. It's worked out once
+per file and then used to look up the context of any line in that file.
+"""
+from bisect import bisect_right
+
+class Outline(object):
+    """Sorted scope ranges of a single file.
+
+    Each scope is a (start, end, parent, context) tuple where start and end are
+    the first and last line numbers inside the scope, parent is the index of
+    the enclosing scope (or -1) and context is the name shown in a GrepTree.
+    Scopes are sorted by start line with parents before their children."""
+
+    def __init__(self, scopes=None):
+        self.scopes = [tuple(z) for z in scopes or []]
+        self._starts = [z[0] for z in self.scopes]
+
+    def contexts(self, line_number):
+        """List the contexts enclosing a line, outermost first."""
+        indx = bisect_right(self._starts, line_number) - 1
+
+        # The last scope to start before this line is either the innermost
+        # scope enclosing it or a descendant of that scope that already ended
+        while indx >= 0 and self.scopes[indx][1] < line_number:
+            indx = self.scopes[indx][2]
+
+        results = []
+        while indx >= 0:
+            results.append(self.scopes[indx][3])
+            indx = self.scopes[indx][2]
+
+        results.reverse()
+        return results
+
+    def to_list(self):
+        """Convert to a list suitable for serialising."""
+        return [list(z) for z in self.scopes]
+
+class ScopeStack(list):
+    """The scopes open at some point during a forward scan of a file, used to
+    build an Outline.
+
+    Each entry is a (level, index, named) tuple. Levels increase towards the
+    top of the stack, index points at this scope in the outline (None for
+    blocks that don't name a context, e.g. an if statement) and named is the
+    index of the innermost named scope at this depth."""
+
+    def __init__(self):
+        super(ScopeStack, self).__init__()
+        self.line_number = 0
+        self.scopes = []
+
+    def open(self, level, context=None):
+        """Open a scope that starts on the line after the current one."""
+        named = self[-1][2] if self else -1
+        if context is None:
+            indx = None
+        else:
+            indx = len(self.scopes)
+            self.scopes.append([self.line_number + 1, None, named, context])
+            named = indx
+
+        self.append((level, indx, named))
+
+    def close(self, level):
+        """Close every scope that the current line ends because it's at
+        this level or lower. The current line isn't part of those scopes."""
+        while self and self[-1][0] >= level:
+            self.pop_scope(self.line_number - 1)
+
+    def pop_scope(self, end=None):
+        """Close the innermost scope. It ends on the current line by default."""
+        _, indx, _ = self.pop()
+        if indx is not None:
+            self.scopes[indx][1] = self.line_number if end is None else end
+
+    def finish(self):
+        """Close anything still open at the end of the file, return Outline."""
+        while self:
+            self.pop_scope()
+
+        return Outline(self.scopes)
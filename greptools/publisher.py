@@ -1,84 +1,135 @@
-from greptools.greptree import count_lines
+import sys
 
 def margin_vals(d):
     max_len = max([len(key) for key in d.values()])
     return {k: v + ' ' * (max_len - len(v)) for k, v in d.iteritems()}
 
+def encode(text):
+    """Publishers write bytes, text from json is unicode."""
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
 class BasePublisher(object):
-    """Formats a GrepTree in a human readible format and sends to stdout."""
+    """Formats a GrepTree in a human readible format and sends to stdout.
+
+    Each file is formatted and written in one go, so if STREAMING is True
+    files can be published one at a time as soon as their hits are resolved
+    (see publish_file()) instead of waiting for the whole tree."""
     # Constants
     LINES = 'lines'
     BREAK_AFTER_LINES = True
+    STREAMING = True
+    TRUNCATED_TEMPLATE = "Stopped at a limit after %d matches in %d files, " \
+                         "there may be more."
 
     def __init__(self, config):
         self.debug = config.debug
+        self.count = 0
+        self.files = 0
 
-    def print_line(self, line_number, line_text, depth):
-        """Formats/prints lines."""
+    def format_line(self, line_number, line_text, depth):
+        """Formats lines, returns None to leave them out."""
         raise NotImplementedError
 
-    def print_context(self, context, depth):
-        """Formats/prints contexts."""
+    def format_context(self, context, depth):
+        """Formats contexts, returns None to leave them out."""
         raise NotImplementedError
 
+    def format_node(self, context, node, depth, out):
+        """Append the formatted lines of a node and it's descendants to out."""
+        text = self.format_context(context, depth)
+        if text is not None:
+            out.append(text)
+
+        lines = node.lines()
+        if lines:
+            for line_num, line_txt in lines:
+                text = self.format_line(line_num, line_txt, depth)
+                if text is not None:
+                    out.append(text)
+            if self.BREAK_AFTER_LINES:
+                out.append('')
+
+        for key, child in node.children.iteritems():
+            self.format_node(key, child, depth + 1, out)
+
+    def publish_file(self, file_path, node):
+        """Print out the results in one file with a single write."""
+        out = []
+        self.format_node(file_path, node, 0, out)
+        sys.stdout.write(''.join(encode(z) + '\n' for z in out))
+        sys.stdout.flush()
+        self.count += node.count
+        self.files += 1
+
+    def finish(self, truncated=False):
+        """Called once everything has been published, truncated says if the
+        search stopped at a limit."""
+        if self.debug:
+            print "Total found: %d" % self.count
+        if truncated:
+            print self.TRUNCATED_TEMPLATE % (self.count, self.files)
+
     def publish(self, tree):
         """Print out information about a tree."""
-        for keys, lines in tree.walk():
-            tail = keys[-1]
-            depth = len(keys) - 1
-            self.print_context(tail, depth)
-            if lines:
-                for line_num, line_txt in lines:
-                    self.print_line(line_num, line_txt, depth)
-                if self.BREAK_AFTER_LINES:
-                    print
+        for file_path, node in tree.root.children.iteritems():
+            self.publish_file(file_path, node)
 
-        if self.debug:
-            print "Total found: %d" % tree._count
+        self.finish(tree.truncated)
 
 class ColouredPublisher(BasePublisher):
     CONTEXT_TEMPLATE = "\033[93m%s\033[0m"
     LINE_TEMPLATE = "\033[91m%d:^\033[0m%s\033[91m$\033[0m"
 
-    def print_line(self, line_number, line_text, depth):
+    def format_line(self, line_number, line_text, depth):
         processed = self.LINE_TEMPLATE % (line_number, line_text)
-        print '    '*(depth + 1), processed
+        return '    '*(depth + 1) + ' ' + processed
 
-    def print_context(self, context, depth):
-        print '    '*depth + self.CONTEXT_TEMPLATE % context
+    def format_context(self, context, depth):
+        return '    '*depth + self.CONTEXT_TEMPLATE % context
 
 class CleanPublisher(BasePublisher):
     CONTEXT_TEMPLATE = "%s"
     LINE_TEMPLATE = "%d:^%s$"
 
-    def print_line(self, line_number, line_text, depth):
+    def format_line(self, line_number, line_text, depth):
         processed = self.LINE_TEMPLATE % (line_number, line_text)
-        print '    '*(depth + 1), processed
+        return '    '*(depth + 1) + ' ' + processed
 
-    def print_context(self, context, depth):
-        print '    '*depth + self.CONTEXT_TEMPLATE % context
+    def format_context(self, context, depth):
+        return '    '*depth + self.CONTEXT_TEMPLATE % context
 
 class FilePublisher(BasePublisher):
     CONTEXT_TEMPLATE = "%s"
     BREAK_AFTER_LINES = False
 
-    def print_line(self, line_number, line_text, depth):
-        pass
+    def format_line(self, line_number, line_text, depth):
+        return None
 
-    def print_context(self, context, depth):
+    def format_context(self, context, depth):
         if depth == 0:
-            print self.CONTEXT_TEMPLATE % context
+            return self.CONTEXT_TEMPLATE % context
+
+    def format_node(self, context, node, depth, out):
+        # Only the file path is printed
+        out.append(self.format_context(context, depth))
 
 class HistPublisher(BasePublisher):
+    # Needs every file's count before it can print anything
+    STREAMING = False
+
     def publish(self, tree):
-        root_keys = {key: key for key in tree.data.keys()}
+        root_keys = {key: key for key in tree.root.children}
         m_keys = margin_vals(root_keys)
         item_counts = {}
         for key in root_keys:
-            st = tree.touch(key)
-            count = count_lines(st)
+            count = tree.root.children[key].count
             item_counts[key] = count
             m_keys[key] += ' ' + str(count)
 
         for key, val in margin_vals(m_keys).iteritems():
             print val, '#' * item_counts[key]
+
+        if tree.truncated:
+            print self.TRUNCATED_TEMPLATE % (tree._count, len(root_keys))
@@ -10,6 +10,8 @@ class GoReader(BraceReader):
             ALL_ATTRS +
             "([a-zA-Z0-9_()\s]+)\s*"
             )
+    # Raw string literals
+    STRINGS = BraceReader.STRINGS + [r'`[^`]*`?']
     FILE_PATTERNS = ['*.go']
     TYPE = 'Go'
 
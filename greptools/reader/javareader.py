@@ -10,6 +10,8 @@ class JavaReader(BraceReader):
             ALL_ATTRS +
             "([a-zA-Z0-9_]+)\s*"
             )
+    # Text blocks have to come before regular string literals
+    STRINGS = [r'"""[\s\S]*?(?:"""|\Z)'] + BraceReader.STRINGS
     FILE_PATTERNS = ['*.java']
     TYPE = 'Java'
 
@@ -1,71 +1,142 @@
 import re
+from tokenize import (generate_tokens, TokenError,
+                      INDENT, DEDENT, NEWLINE, NL, COMMENT)
+
+from greptools.outline import ScopeStack
 from .reader import BaseReader
 
 class IndentReader(BaseReader):
+    """A reader for languages that use indentation to inclose code blocks.
+
+    To use this: inherit and implement _line_match() and _parse_line().
+    SCOPE_PREFIXES can be set to what a line that opens a scope starts with
+    (after indentation) so other lines needn't be matched at all.
+    """
     TAB = '\t'
     FOUR_SPACES = '    '
+    SCOPE_PREFIXES = None
 
     def _get_indent(self, line):
         """
-        Returns the indentation on a line as a substring.
+        Returns the width of the indentation on a line.
         """
-        match = re.match(self.INDENT_RE, line)
-        indent = match.group(1)
-
-        return re.sub(self.TAB, self.FOUR_SPACES, indent)
+        indent = len(line) - len(line.lstrip())
+        tabs = line.count(self.TAB, 0, indent)
 
-    def get_context(self, file_path, file_line, tree=None):
-        # Zero-based index for file line number
-        file_indx = file_line - 1
+        return indent + tabs * (len(self.FOUR_SPACES) - 1)
 
-        if tree is None:
-            tree = self.tree
-
-        # Create a branch in the tree for this file
-        tree.touch(file_path)
+    def build_outline(self, lines):
+        """Build the scope table of a file in one pass. Only named scopes are
+        kept on the stack, a line closes any of them indented as far as it."""
+        scopes = ScopeStack()
+        prefixes = self.SCOPE_PREFIXES
+        for line_number, line_text in enumerate(lines, 1):
+            # Ignore empty lines
+            if not line_text.strip('\r\n'):
+                continue
 
-        lines = self.get_lines(file_path, file_indx)
-        assert len(lines) == file_line
+            indent = self._get_indent(line_text)
+            scopes.line_number = line_number
+            if scopes and scopes[-1][0] >= indent:
+                scopes.close(indent)
 
-        # Get indent of specified line
-        init_indent = self._get_indent(lines[file_indx])
+            # Ignore lines that aren't a function or a class
+            if prefixes is not None and \
+                    not line_text.lstrip().startswith(prefixes):
+                continue
+            if self._line_match(line_text):
+                scopes.open(indent, self._parse_line(line_text))
 
-        results = []
-        for line_no in range(file_indx-1, -1, -1):
-            # Ignore empty lines
-            if lines[line_no].strip('\r\n'):
-                # Get indent of relevant lines
-                next_indent = self._get_indent(lines[line_no])
-
-                # if line has less indentation 
-                if len(next_indent) < len(init_indent):
-                    # Ignore lines that aren't a function or a class
-                    if self._line_match(lines[line_no]):
-                        # add to results
-                        results.append(
-                            self._parse_line(lines[line_no])
-                            )
-
-                    # then change init_indent
-                    init_indent = next_indent
-
-        # Add this entry to context tree
-        tree.append(
-                file_path,
-                file_line,
-                lines[file_indx].strip('\r\n'),
-                reversed(results)
-                )
+        # Anything left open runs until the last line
+        scopes.line_number = len(lines)
+        return scopes.finish()
 
 
 class PythonReader(IndentReader):
-    """An implementation of a Reader for Python code."""
+    """An implementation of a Reader for Python code.
+
+    If config.exact is set, outlines are built from the output of the
+    tokenize module instead of guessing from indentation. This handles
+    decorators, async functions, multi-line strings, etc. If a file can't be
+    tokenized, it falls back on the indentation based approach."""
     # CONSTANTS
-    INDENT_RE = re.compile("^(\s*)")
     DEF_CLASS_RE = re.compile("^\s*(def|class) (.*?)[(:]")
+    SCOPE_PREFIXES = ('def ', 'class ')
+    DEF_CLASS = ('def', 'class')
     FILE_PATTERNS = ['*.py']
     TYPE = 'Python'
 
+    def __init__(self, config):
+        self.exact = config.exact
+        super(PythonReader, self).__init__(config)
+
+        # Tokenizing half a file would fail part way through a statement
+        if self.exact:
+            self.whole_file = True
+
+    def outline_key(self):
+        if self.exact:
+            return self.TYPE + ' exact'
+        else:
+            return self.TYPE
+
+    def build_outline(self, lines):
+        if self.exact:
+            try:
+                return self._exact_outline(lines)
+            except (TokenError, IndentationError):
+                pass
+
+        return super(PythonReader, self).build_outline(lines)
+
+    def _exact_outline(self, lines):
+        """Build an outline from INDENT/DEDENT tokens. A block is named if the
+        logical line before it is a def or class statement."""
+        scopes = ScopeStack()
+        head = []
+        head_row = 0
+        last = None
+        cntxt = None
+        for tok_type, tok_str, (row, _), _, _ in \
+                generate_tokens(iter(lines).next):
+            if tok_type == INDENT:
+                # Continuation lines of a def/class statement are inside it
+                scopes.line_number = head_row
+                scopes.open(len(scopes), cntxt)
+            elif tok_type == DEDENT:
+                # Dedents come just before the first statement after a block
+                scopes.line_number = row
+                scopes.pop_scope(row - 1)
+            elif tok_type == NEWLINE:
+                cntxt = self._header_context(head, last)
+                head = []
+                continue
+            elif tok_type not in (NL, COMMENT):
+                if not head:
+                    head_row = row
+                if len(head) < 3:
+                    head.append(tok_str)
+                last = tok_str
+
+            if tok_type not in (NL, COMMENT):
+                cntxt = None
+
+        # Anything left open runs until the last line
+        scopes.line_number = len(lines)
+        return scopes.finish()
+
+    def _header_context(self, head, last):
+        """Given the first few tokens and the last token of a logical line,
+        returns the context of the block it opens (None if not def/class)."""
+        if last != ':':
+            return None
+
+        if head and head[0] == 'async':
+            head = head[1:]
+
+        if len(head) > 1 and head[0] in self.DEF_CLASS:
+            return '%s %s' % (head[0], head[1])
+
     def _line_match(self, line_text):
         if re.search(self.DEF_CLASS_RE, line_text):
             return True
@@ -1,50 +1,97 @@
 import sys
+import os
 import re
-
-from greptools.greptree import GrepTree, count_lines
-from greptools.searcher import Searcher
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from threading import Thread
+
+from greptools import stats
+from greptools.cache import OutlineCache, ResultCache, tree_fingerprint
+from greptools.greptree import GrepTree
+from greptools.outline import ScopeStack
+from greptools.searcher import Searcher, group_rows
+from greptools.snapshot import Snapshot, fingerprints
 
 def warn(msg):
     """Print message in a warning header."""
     print "=== \033[91mWarn: %s\033[0m ===\n" % str(msg)
 
-def set_op(a_subtree, b_subtree, func1, func2):
-    """Convienience function for performing a set operation on two sub trees."""
-    # Using a closure as a counter is difficult so we'll sum a list instead
-    count = []
-
-    def _set_op(a_subtree, b_subtree, func1, func2):
-        """Recursive function for performing set operations."""
-        a_nodes = set(a_subtree.keys())
-        b_nodes = set(b_subtree.keys())
-
-        floor = {}
-        for node in func1(a_nodes, b_nodes):
-            if node == 'lines':
-                a_set = set(tuple(z) for z in a_subtree.get(node, []))
-                b_set = set(tuple(z) for z in b_subtree.get(node, []))
-
-                temp = func2(a_set, b_set)
-                count.append(len(temp))
-                if temp != []:
-                    floor[node] = temp
-
-            else:
-                a_branch = a_subtree.get(node, {})
-                b_branch = b_subtree.get(node, {})
-
-                if not a_branch and b_branch:
-                    temp = a_branch if a_branch else b_branch
-                    count.append(count_lines(temp))
-                else:
-                    temp = _set_op(a_branch, b_branch, func1, func2)
-
-                if temp != {}:
-                    floor[node] = temp
-
-        return floor
-
-    return _set_op(a_subtree, b_subtree, func1, func2), sum(count)
+# Which lines each set operation keeps, given whether they're in the tree
+# piped in and/or the tree searched for
+SET_OPS = {
+        'union': lambda in_a, in_b: in_a or in_b,
+        'diff': lambda in_a, in_b: in_a != in_b,
+        'exclude': lambda in_a, in_b: in_a and not in_b,
+        'inter': lambda in_a, in_b: in_a and in_b,
+        }
+
+_END = object()
+
+def merge_keys(a_keys, b_keys):
+    """Walk two sorted sequences of keys (see GrepTree.keys()) in step,
+    yielding (key, in_a, in_b) once for each distinct key."""
+    a_keys = iter(a_keys)
+    b_keys = iter(b_keys)
+    a_key = next(a_keys, _END)
+    b_key = next(b_keys, _END)
+    while a_key is not _END or b_key is not _END:
+        if b_key is _END or (a_key is not _END and a_key < b_key):
+            key = a_key
+        else:
+            key = b_key
+
+        in_a = a_key is not _END and a_key == key
+        in_b = b_key is not _END and b_key == key
+        yield key, in_a, in_b
+
+        while a_key is not _END and a_key == key:
+            a_key = next(a_keys, _END)
+        while b_key is not _END and b_key == key:
+            b_key = next(b_keys, _END)
+
+def set_op(a_tree, b_tree, keep):
+    """Convienience function for performing a set operation on two GrepTrees.
+
+    Both trees are flattened into sorted keys and merged in a single pass,
+    keep(in_a, in_b) decides which lines make it into the new tree. Returns
+    the new tree and the number of lines in it."""
+    tree = GrepTree.from_keys(
+            key for key, in_a, in_b in merge_keys(a_tree.keys(), b_tree.keys())
+            if keep(in_a, in_b)
+            )
+    tree.truncated = a_tree.truncated or b_tree.truncated
+
+    return tree, tree._count
+
+# Each process in a pool gets it's own reader, see BaseReader.add_to_tree()
+_WORKER_READER = None
+
+def _init_worker(reader_cls, config):
+    """Create the reader used by this worker process."""
+    global _WORKER_READER
+    _WORKER_READER = reader_cls(config)
+
+def _resolve_worker(groups):
+    """Resolve the contexts of all hits in some files inside a worker process."""
+    return [
+            (file_path, _WORKER_READER.resolve_lines(
+                file_path,
+                file_lines,
+                line_texts,
+                lines
+                ))
+            for file_path, file_lines, line_texts, lines in groups
+            ]
+
+def chunks(iterable, size):
+    """Yields lists of up to size items at a time from iterable."""
+    iterable = iter(iterable)
+    while True:
+        chunk = list(islice(iterable, size))
+        if not chunk:
+            return
+        yield chunk
 
 def replace_parens(text):
     """Replaces anything wrapped in parenthesis with '(...)'.
@@ -60,23 +107,64 @@ def replace_parens(text):
 
     return re.sub(u'\uE000', '(...)', text)
 
+class Background(object):
+    """Runs func(*args) on a thread. get() waits for it to finish and returns
+    what it returned, or raises what it raised (including SystemExit)."""
+
+    def __init__(self, func, *args):
+        self._result = None
+        self._error = None
+        self._thread = Thread(target=self._run, args=(func, args))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, func, args):
+        try:
+            self._result = func(*args)
+        except BaseException:
+            self._error = sys.exc_info()
+
+    def get(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+
+        return self._result
+
 class BaseReader(object):
     """Base class only. Please subclass and implement the following:
 
     - FILE_PATTERNS : a list of file extensions to pass to Searcher.
     - TYPE : The name of the programming language this Reader specialises in
-    - get_context() : Given a file and line number,
-                        this should return the lines context."""
+    - _update_scopes() : Given the open scopes (a ScopeStack) and the next
+                        line of a file, open/close any scopes that line affects.
+                        Alternatively, override build_outline()."""
 
     # Things that should be defined by subclass
     FILE_PATTERNS = []
     TYPE = ''
 
+    # Number of files sent to a worker process at a time
+    CHUNK_SIZE = 16
+
     def __init__(self, config):
         self.tree = GrepTree()
         self.config = config
         self.debug = config.debug
 
+        if config.cache or OutlineCache.in_memory():
+            self.outlines = OutlineCache(self.outline_key(), disk=config.cache)
+        else:
+            self.outlines = None
+
+        # Read files up to the last hit unless the whole outline is needed
+        self.whole_file = self.outlines is not None
+
+        self.results = ResultCache() if config.cache else None
+
+        # Given each file's node as soon as it's resolved, see from_grep()
+        self.stream = None
+
     @classmethod
     def from_file(cls, config, path):
         """Create Reader and populate tree from file."""
@@ -86,19 +174,40 @@ class BaseReader(object):
         return temp
 
     @classmethod
-    def from_grep(cls, config):
-        """Create Reader and populate tree by grepping files."""
+    def from_grep(cls, config, stream=None):
+        """Create Reader and populate tree by grepping files.
+
+        If stream is given, it's called with the path and node of each file
+        as soon as it's hits are resolved. Those files are then dropped from
+        the tree, unless it's needed for the result cache."""
         temp = cls(config)
+        temp.stream = stream
         temp.tree = temp.build_tree(config.search_term)
 
         return temp
 
     @classmethod
-    def from_pipe(cls, config):
-        """Create Reader and read tree from incomming pipe."""
+    def from_refresh(cls, config):
+        """Create Reader and populate tree by bringing the snapshot at
+        config.refresh up to date."""
+        temp = cls(config)
+        temp.tree = temp.refresh(config.refresh, config.search_term)
+
+        return temp
+
+    @classmethod
+    def search_in_background(cls, config):
+        """Start searching for config.search_term on another thread, returns
+        a Background that gives the GrepTree."""
+        return Background(cls(config).build_tree, config.search_term)
+
+    @classmethod
+    def from_pipe(cls, config, inp=None):
+        """Create Reader and read tree from incomming pipe (stdin by default)."""
         temp = cls(config)
         try:
-            temp.tree = GrepTree.load(sys.stdin)
+            with stats.stage('load'):
+                temp.tree = GrepTree.load(sys.stdin if inp is None else inp)
         except ValueError:
             if temp.debug:
                 warn("Choked on input from pipe")
@@ -107,233 +216,449 @@ class BaseReader(object):
         return temp
 
     @staticmethod
-    def get_lines(file_path, file_indx):
-        """Returns lines in a file leading upto a certain line (inclusive)."""
+    def get_lines(file_path, file_indx=None):
+        """Returns lines in a file leading upto a certain line (inclusive).
+        Returns the whole file if file_indx is None."""
         lines = []
-        with open(file_path) as file_:
-            for i, line in enumerate(file_):
-                if i <= file_indx:
-                    lines.append(line)
-                else:
-                    break
+        with stats.stage('read'), open(file_path) as file_:
+            stats.count('files_opened')
+            if file_indx is None:
+                lines = file_.readlines()
+            else:
+                for i, line in enumerate(file_):
+                    if i <= file_indx:
+                        lines.append(line)
+                    else:
+                        break
+
+            stats.count('bytes_read', sum(len(z) for z in lines))
 
         return lines
 
-    def build_tree(self, query):
-        """Perform grep search and sort results into GrepTree."""
-        # Grep for expresion
+    def build_tree(self, query, paths=None):
+        """Perform search (only in paths if given) and sort results into
+        GrepTree. If results are cached, the same search over the same files
+        isn't done again."""
+        with stats.stage('build_tree'):
+            return self._build_tree(query, paths)
+
+    def _build_tree(self, query, paths=None):
         searcher = Searcher(self.config, self.FILE_PATTERNS)
-        results = searcher.grep_for(query)
+
+        key = None
+        if self.results is not None:
+            key = self.result_key(query, searcher, paths)
+        if key is not None:
+            tree = self.results.get(key)
+            if tree is not None:
+                if self.debug:
+                    print "=== Using cached results ===\n"
+                for file_path in tree.root.children.keys():
+                    self._file_done(file_path, tree, False)
+                return tree
+
+        # Search for expresion, stopping early at any limits
+        groups = searcher.limit(searcher.search(query, paths))
 
         # Create a temp tree and add all results to tree
         tree = GrepTree()
-        self.add_to_tree(results, tree)
+        self.add_groups(groups, tree)
+        tree.truncated = searcher.truncated
+
+        if key is not None:
+            self.results.put(key, tree)
 
         return tree
 
-    # TODO: The methods below should print additional debug info of the comparison tree
+    def result_key(self, query, searcher, paths=None):
+        """Identifies the results of a search in ResultCache. Returns None if
+        files have changed too recently to tell if they've changed again."""
+        if paths is None:
+            # The search is over the same files if it has to be done
+            paths = searcher.all_files()
+        files = tree_fingerprint(paths)
+        if files is None:
+            return None
+
+        return repr((
+                self.outline_key(),
+                query,
+                self.config.case_off,
+                self.config.backend,
+                self.config.no_ignore,
+                self.config.ignore_file,
+                searcher.max_count,
+                searcher.max_per_file,
+                searcher.max_files,
+                files,
+                ))
+
+    def refresh(self, path, query):
+        """
+        Bring the snapshot of a query's results saved at path up to date and
+        return the tree. Only files that are new, changed or deleted since it
+        was saved are searched again (or those git says have changed since
+        config.since). If there's no snapshot for this query, everything is
+        searched and a new one is saved.
+        """
+        searcher = Searcher(self.config, self.FILE_PATTERNS)
+        snapshot = Snapshot(path)
+        key = {
+                'reader': self.TYPE,
+                'search_term': query,
+                'case_off': self.config.case_off,
+                }
+        tree, files = snapshot.load(key)
+
+        current = fingerprints(searcher.find_files())
+        if tree is None:
+            tree = GrepTree()
+            changed = sorted(current)
+        elif self.config.since:
+            changed = searcher.changed_since(self.config.since)
+        else:
+            changed = sorted(
+                    z for z in set(current) | set(files)
+                    if current.get(z) is None or current.get(z) != files.get(z)
+                    )
 
-    def union(self):
-        """Perform union set operation against GrepTree piped in."""
-        tree = self.build_tree(self.config.search_term)
+        if self.debug:
+            print "=== Refresh ==="
+            print " %d of %d files to search again\n" % (
+                    len(changed),
+                    len(current)
+                    )
 
-        func1 = lambda a, b: a | b
-        func2 = lambda a, b: list(a | b)
+        # Splice the new results for each of those files into the tree
+        for file_path in changed:
+            tree.remove(file_path)
 
-        self.tree.data, self.tree._count = set_op(
-                self.tree.data,
-                tree.data,
-                func1,
-                func2
-                )
+        changed = [z for z in changed if z in current]
+        if changed:
+            self.add_groups(searcher.search(query, changed), tree)
 
-    def diff(self):
-        """Perform XOR set operation against GrepTree piped in."""
-        tree = self.build_tree(self.config.search_term)
+        snapshot.save(tree, key, current)
+        return tree
 
-        func1 = lambda a, b: a | b
-        func2 = lambda a, b: list(a ^ b)
+    # TODO: The methods below should print additional debug info of the comparison tree
 
-        self.tree.data, self.tree._count = set_op(
-                self.tree.data,
-                tree.data,
-                func1,
-                func2
-                )
+    def union(self, tree=None):
+        """Perform union set operation against GrepTree piped in. tree is the
+        result of the search if it's already been done."""
+        if tree is None:
+            tree = self.build_tree(self.config.search_term)
+        self.tree, _ = set_op(self.tree, tree, SET_OPS['union'])
 
-    def exclude(self):
-        """Filter results piped in from those in current GrepTree"""
-        tree = self.build_tree(self.config.search_term)
+    def diff(self, tree=None):
+        """Perform XOR set operation against GrepTree piped in. tree is the
+        result of the search if it's already been done."""
+        if tree is None:
+            tree = self.build_tree(self.config.search_term)
+        self.tree, _ = set_op(self.tree, tree, SET_OPS['diff'])
 
-        func1 = lambda a, b: a
-        func2 = lambda a, b: list(a - b)
+    def piped_files(self):
+        """Paths of the files in the tree piped in that still exist."""
+        paths = []
+        for path in sorted(self.tree.root.children):
+            if os.path.isfile(path):
+                paths.append(path)
 
-        self.tree.data, self.tree._count = set_op(
-                self.tree.data,
-                tree.data,
-                func1,
-                func2
-                )
+        return paths
+
+    def exclude(self):
+        """Filter results piped in from those in current GrepTree. Only the
+        files piped in are searched."""
+        tree = self.build_tree(self.config.search_term, self.piped_files())
+        self.tree, _ = set_op(self.tree, tree, SET_OPS['exclude'])
 
     def inter(self):
-        """Perform intersection set operation against GrepTree piped in."""
-        tree = self.build_tree(self.config.search_term)
+        """Perform intersection set operation against GrepTree piped in. Only
+        the files piped in are searched."""
+        tree = self.build_tree(self.config.search_term, self.piped_files())
+        self.tree, _ = set_op(self.tree, tree, SET_OPS['inter'])
+
+    def filter_patterns(self):
+        """The search term along with any -e patterns, each compiled once."""
+        patterns = []
+        if self.config.search_term is not None:
+            patterns.append(self.config.search_term)
+        patterns.extend(self.config.patterns or [])
+
+        flags = re.IGNORECASE if self.config.case_off else 0
+        try:
+            return [re.compile(z, flags) for z in patterns]
+        except re.error, err:
+            print "Whoops, couldn't compile '%s': %s" % (
+                    "', '".join(patterns),
+                    err
+                    )
+            sys.exit()
 
-        func1 = lambda a, b: a & b
-        func2 = lambda a, b: list(a & b)
+    def fast_inter(self):
+        """Perform intersection on tree using python's re module, keeping
+        lines that match every pattern."""
+        regexes = self.filter_patterns()
+        if len(regexes) == 1:
+            keep = regexes[0].search
+        else:
+            keep = lambda text: all(z.search(text) for z in regexes)
 
-        self.tree.data, self.tree._count = set_op(
-                self.tree.data,
-                tree.data,
-                func1,
-                func2
-                )
+        self.tree.filter(keep)
 
-    def fast_inter(self):
-        """Perform intersection on tree using python's re module."""
-        to_prune = []
-        total_lines = 0
-        for keys, lines in self.tree.walk():
-            lines = [z for z in lines if re.search(
-                                            self.config.search_term,
-                                            z[1])
-                                            ]
-            self.tree.set_lines(keys, lines)
-            len_lines = len(lines)
-            if len_lines == 0:
-                to_prune.append((len(keys), keys))
-            else:
-                total_lines += len_lines
+    def fast_exclude(self):
+        """Filter a tree using python's re module, dropping lines that match
+        any pattern."""
+        regexes = self.filter_patterns()
+        if not regexes:
+            return
+
+        # One pass of a single regex is quicker than trying each in turn, but
+        # joining them would renumber groups (breaking backreferences) and
+        # inline flags like (?i) would apply to all of them
+        if len(regexes) == 1:
+            regex = regexes[0]
+        elif not any(z.groups or '(?' in z.pattern for z in regexes):
+            regex = re.compile(
+                    '|'.join('(?:%s)' % z.pattern for z in regexes),
+                    regexes[0].flags
+                    )
+        else:
+            regex = None
+
+        if regex is not None:
+            self.tree.filter(lambda text: not regex.search(text))
+        else:
+            self.tree.filter(
+                    lambda text: not any(z.search(text) for z in regexes)
+                    )
 
-        for _, keys in sorted(to_prune, reverse=True):
-            self.tree.prune(keys)
+    def add_to_tree(self, results, tree=None):
+        """Take grep results and add them to a GrepTree."""
+        self.add_groups(group_rows(results), tree)
 
-        self.tree._count = total_lines
+    def add_groups(self, groups, tree=None):
+        """Take the hits in each file (see Searcher.search()) and add them to
+        a GrepTree.
 
-    def fast_exclude(self):
-        """Filter a tree using python's re module."""
-        to_prune = []
-        total_lines = 0
-        for keys, lines in self.tree.walk():
-            lines = [z for z in lines if not re.search(
-                                            self.config.search_term,
-                                            z[1])
-                                            ]
-            self.tree.set_lines(keys, lines)
-            len_lines = len(lines)
-            if len_lines == 0:
-                to_prune.append((len(keys), keys))
-            else:
-                total_lines += len_lines
+        Hits are grouped by file so each file is only read and scanned once,
+        no matter how many hits it contains. If config.jobs isn't 1, files are
+        shared out between a pool of worker processes."""
+        if tree is None:
+            tree = self.tree
 
-        for _, keys in sorted(to_prune, reverse=True):
-            self.tree.prune(keys)
+        groups = stats.timed('search', groups)
+        if self.config.jobs == 1:
+            for file_path, file_lines, line_texts, lines in groups:
+                self.resolve_file(file_path, file_lines, tree, line_texts, lines)
+        else:
+            self._add_parallel(groups, tree)
+
+    def _add_parallel(self, groups, tree):
+        """Resolve groups of hits in a pool of processes.
+
+        Groups are handed out from this process (so grep results are still
+        read as they arrive) and the entries workers hand back are appended
+        in the same order as a serial run, so the resulting tree is identical."""
+        processes = self.config.jobs or cpu_count()
+        pool = Pool(processes, _init_worker, (type(self), self.config))
+        pending = deque()
+        try:
+            for chunk in chunks(groups, self.CHUNK_SIZE):
+                pending.append(pool.apply_async(_resolve_worker, (chunk,)))
 
-        self.tree._count = total_lines
+                # Collect finished work without letting too much queue up
+                while pending and (pending[0].ready() or
+                                   len(pending) > 2 * processes):
+                    self._add_resolved(self._wait(pending.popleft()), tree)
 
-    def add_to_tree(self, results, tree=None):
-        """Take result and add it to current GrepTree."""
+            while pending:
+                self._add_resolved(self._wait(pending.popleft()), tree)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def _wait(result):
+        """Wait for a worker to finish, work done in workers only shows up
+        in --stats as time spent waiting."""
+        with stats.stage('wait_workers'):
+            return result.get()
+
+    def _add_resolved(self, resolved, tree):
+        """Add entries for several files that were resolved by a worker."""
+        for file_path, entries in resolved:
+            self.add_entries(file_path, entries, tree)
+            self._file_done(file_path, tree)
+
+    def _file_done(self, file_path, tree, discard=None):
+        """Pass a file that's been resolved on to self.stream, if there is
+        one. It's then discarded if the tree won't be cached."""
+        if self.stream is None:
+            return
+
+        self.stream(file_path, tree.root.children[file_path])
+        if discard is None:
+            discard = self.results is None
+        if discard:
+            tree.remove(file_path)
+
+    def resolve_file(self, file_path, file_lines, tree=None, line_texts=None,
+                     lines=None):
+        """
+        Given a file path and a list of line numbers, determine the context of
+        each line and add them to the tree.
+        """
         if tree is None:
             tree = self.tree
 
-        for row in results:
-            file_name, file_line, _ = row.split(':')[:3]
+        self.add_entries(
+                file_path,
+                self.resolve_lines(file_path, file_lines, line_texts, lines),
+                tree
+                )
+        self._file_done(file_path, tree)
+
+    def resolve_lines(self, file_path, file_lines, line_texts=None, lines=None):
+        """
+        Given a file path and a list of line numbers, returns a list of
+        (line_number, line_text, contexts) for each line.
+
+        If the text of each line is already known (e.g. from grep) and the
+        file's outline is cached, the file isn't read at all. Neither is it if
+        all of it's lines are passed in (e.g. by the python search backend).
+        """
+        outline = None
+        if self.outlines is not None:
+            stat = os.stat(file_path)
+            outline = self.outlines.get(file_path, stat)
+
+        if outline is not None and line_texts is not None:
+            texts = [z.strip('\r\n') for z in line_texts]
+        else:
+            if lines is None and self.whole_file:
+                lines = self.get_lines(file_path)
+            elif lines is None:
+                lines = self.get_lines(file_path, max(file_lines) - 1)
+            assert len(lines) >= max(file_lines)
+
+            texts = [lines[z - 1].strip('\r\n') for z in file_lines]
+
+            if outline is None:
+                with stats.stage('outline'):
+                    outline = self.build_outline(lines)
+                if self.outlines is not None:
+                    self.outlines.put(file_path, stat, outline)
+
+        return sorted(
+                (line, text, outline.contexts(line))
+                for line, text in zip(file_lines, texts)
+                )
+
+    @staticmethod
+    def add_entries(file_path, entries, tree):
+        """Add the entries from resolve_lines() to a tree."""
+        # Create a branch in the tree for this file
+        tree.touch(file_path)
+        stats.count('hits_resolved', len(entries))
+
+        for file_line, line_text, contexts in entries:
+            tree.append(file_path, file_line, line_text, contexts)
+
+    def build_outline(self, lines):
+        """Walk forward through the lines of a file once, keeping track of
+        which scopes are open, and return the resulting Outline."""
+        scopes = ScopeStack()
+        for line in lines:
+            scopes.line_number += 1
+            self._update_scopes(scopes, line)
+
+        return scopes.finish()
 
-            self.get_context(file_name, int(file_line), tree)
+    def outline_key(self):
+        """Identifies the kind of outline this reader builds in OutlineCache."""
+        return self.TYPE
 
     def get_context(self, file_path, file_line, tree=None):
         """
         Given the file path and the line number, determine the context of that line.
         """
+        self.resolve_file(file_path, [file_line], tree)
+
+    def _update_scopes(self, scopes, line_text):
         raise NotImplementedError
 
 class BraceReader(BaseReader):
     """A reader for languages that use braces to inclose code blocks.
 
     To use this: inherit and implement OPEN_BLOCK, CLOSE_BLOCK, END_LINE and
-    _parse_line().
+    _parse_line(). COMMENTS and STRINGS are regexes for the comments and
+    literals that should be skipped over when looking for braces.
     """
     OPEN_BLOCK = '{'
     CLOSE_BLOCK = '}'
     END_LINE = ';'
+    COMMENTS = [
+            r'//[^\n]*',
+            r'/\*[\s\S]*?(?:\*/|\Z)',
+            ]
+    STRINGS = [
+            r'"(?:\\.|[^"\\\n])*"?',
+            r"'(?:\\.|[^'\\\n])*'?",
+            ]
 
-    def _scan_file(self, full_text, next_ref):
-        results = []
-        while True:
-            end = self.recursive_rfind(
-                    full_text,
-                    self.OPEN_BLOCK,
-                    self.CLOSE_BLOCK,
-                    next_ref
-                    )
-
-            start = self.recursive_rfind(
-                    full_text,
-                    self.all_chars,
-                    '',
-                    end
-                    )
-
-            cntxt = full_text[start:end].strip(self.all_chars)
-            if self._line_match(cntxt):
-                results.append(self._parse_line(cntxt))
-            next_ref = end
-            if start == 0:
-                break
-
-        return results
-
-    def get_context(self, file_path, file_line, tree=None):
-        # Zero-based index for file line number
-        file_indx = file_line - 1
-
-        if tree is None:
-            tree = self.tree
-
-        # Create a branch in the tree for this file
-        tree.touch(file_path)
-
-        lines = self.get_lines(file_path, file_indx)
-        assert len(lines) == file_line
-
-        self.all_chars = self.CLOSE_BLOCK + self.OPEN_BLOCK + self.END_LINE
-        full_text = '\n'.join(lines)
-        next_ref = len('\n'.join(lines[:file_indx]))
-
-        results = self._scan_file(full_text, next_ref)
-
-        # Add this entry to context tree
-        tree.append(
-                file_path,
-                file_line,
-                lines[file_indx].strip('\r\n'),
-                reversed(results)
-                )
-
-    @staticmethod
-    def recursive_rfind(text, find, stepover, end):
-        def _rfind(text, exp, find, stepover, start):
-            while True:
-                # Search
-                match = re.search(exp, text[start:])
-
-                case = None
-                if match:
-                    result = start + match.start() + 1
-                    case = match.group(0)
-
-                # Decide what to do next
-                if not case:
-                    return len(text)
-                elif case in find:
-                    return result
-                elif case in stepover:
-                    start = _rfind(text, exp, find, stepover, result)
-
-        exp = r"[%s%s]" % (find, stepover)
-        start = len(text) - end
-        result = _rfind(''.join(reversed(text)), exp, find, stepover, start)
-        return len(text) - result
+    def __init__(self, config):
+        super(BraceReader, self).__init__(config)
+        delims = [self.OPEN_BLOCK, self.CLOSE_BLOCK, self.END_LINE]
+
+        # Anything that could start a comment, literal or delimiter ends a
+        # run of plain text
+        specials = ''.join(delims) + '/"\'`'
+
+        self._tokens_re = re.compile('|'.join([
+                '(?P<comment>%s)' % '|'.join(self.COMMENTS),
+                '(?P<string>%s)' % '|'.join(self.STRINGS),
+                '(?P<delim>%s)' % '|'.join(re.escape(z) for z in delims),
+                r'(?P<text>[^%s]+|[\s\S])' % re.escape(specials),
+                ]))
+
+    def build_outline(self, lines):
+        """Tokenize the file in a single pass, skipping over comments and
+        literals, keeping track of which blocks are open."""
+        text = ''.join(lines)
+        scopes = ScopeStack()
+        scopes.line_number = 1
+        counted = 0
+        pending = []
+        for match in self._tokens_re.finditer(text):
+            kind = match.lastgroup
+            token = match.group()
+
+            # Collect the text leading up to the next delimiter
+            if kind == 'text' or kind == 'string':
+                pending.append(token)
+                continue
+            elif kind == 'comment':
+                pending.append('\n' if '\n' in token else ' ')
+                continue
+
+            start = match.start()
+            scopes.line_number += text.count('\n', counted, start)
+            counted = start
+
+            if token == self.OPEN_BLOCK:
+                cntxt = ''.join(pending)
+                if self._line_match(cntxt):
+                    scopes.open(len(scopes), self._parse_line(cntxt))
+                else:
+                    scopes.open(len(scopes))
+            elif token == self.CLOSE_BLOCK:
+                if scopes:
+                    scopes.pop_scope()
+            pending = []
+
+        # Anything left open runs until the last line
+        scopes.line_number = len(lines)
+        return scopes.finish()
 
     def _parse_line(self, line_text):
         raise NotImplementedError
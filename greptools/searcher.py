@@ -1,120 +1,704 @@
 import subprocess
+import mmap
+import os
 import os.path
+import re
+import sys
+from cStringIO import StringIO
+from fnmatch import translate as fntranslate
+from heapq import heappop, heappush
+from itertools import chain, groupby
+from multiprocessing import cpu_count
+from Queue import Queue, Empty, Full
+from pipes import quote
 from sys import exit as sys_exit
+from tempfile import TemporaryFile
+from threading import Event, Thread
 
-from fnmatch import filter as fnfilter
-from os import walk, getcwd
+from greptools import stats
+from greptools.cache import CACHE_DIR
+from greptools.ignore import walk_files
+from greptools.index import TrigramIndex, required_trigrams
 
-def glob_recursive(ptrn):
-    """Returns a list of paths under ./ that match a given glob pattern."""
-    ptrn = ptrn[:-1] if ptrn[-1] == '/' else ptrn
+class GrepError(Exception):
+    """grep exited with an error."""
 
-    dir_matches = []
-    file_matches = []
-    for root, dirnames, filenames in walk(getcwd()):
-        for dirname in fnfilter(dirnames, ptrn):
-            dir_matches.append(os.path.relpath(os.path.join(root, dirname)))
-        for filename in fnfilter(filenames, ptrn):
-            file_matches.append(os.path.join(root, filename))
+    def __init__(self, returncode):
+        super(GrepError, self).__init__(returncode)
+        self.returncode = returncode
 
-    return dir_matches, file_matches
+def child_stderr():
+    """Where a command should write it's errors. That's our own stderr unless
+    sys.stderr has been swapped (e.g. for a server's client), then they're
+    collected in a file to be passed on with copy_stderr()."""
+    if sys.stderr is sys.__stderr__:
+        return None
+    return TemporaryFile()
+
+def copy_stderr(errors):
+    """Write out the errors collected by child_stderr() if there are any."""
+    if errors is not None:
+        errors.seek(0)
+        sys.stderr.write(errors.read())
+        errors.close()
+
+def group_rows(rows):
+    """Group grep's output rows by file. Yields a (file_path, file_lines,
+    line_texts, lines) tuple for each file, lines is always None because grep
+    doesn't give us the rest of the file."""
+    rows = (row.split(':', 2) for row in rows)
+    for file_path, group in groupby(rows, lambda row: row[0]):
+        file_lines, line_texts = zip(*[(int(z[1]), z[2]) for z in group])
+        yield file_path, file_lines, line_texts, None
 
 class Searcher(object):
-    """Constructs and executes grep queries."""
-    GREP_TEMPLATE = 'grep ./ -Irn%se "%s"%s%s'
-    INCLUDES_TEMPLATE = ' --include="%s"'
-    EXCLUDES_TEMPLATE = ' --exclude="%s"'
-    EXCLUDE_DIRS_TEMPLATE = ' --exclude-dir="%s"'
+    """Finds the files to search and searches them, either with grep, with
+    git grep or with python's re module (see BACKENDS)."""
+    BACKENDS = ['grep', 'git', 'python']
+    GREP_CMD = ['grep', '-HIns']
+    GIT_GREP_CMD = [
+            'git', '-c', 'core.quotePath=false', 'grep',
+            '-HIn', '--no-color',
+            ]
+    NESTED_IGNORE_FILE = '.gitignore'
+    ALWAYS_SKIP = ('.git', CACHE_DIR)
+
+    # Files are passed to grep on the command line, a batch at a time, so
+    # this should be comfortably under ARG_MAX
+    BATCH_BYTES = 64 * 1024
+
+    # How many files' rows each shard's grep can get ahead of the ones being
+    # passed on
+    READ_AHEAD = 64
 
     def __init__(self, config, file_patterns=[]):
         self.file_patterns = file_patterns
         self.config = config
         self.debug = config.debug
 
-    def get_exclds(self):
-        """Build list of file paths to ignore in upcomming search."""
-        if not self.config.no_ignore and self.config.ignore_file:
-            exclds = set()
-            excld_dirs = set()
-            try:
-                with open(self.config.ignore_file, 'r') as inp:
-                    for row in inp:
-                        row = row.strip('\r\n')
-                        if row and row[0] == '*':
-                            dirs, files = glob_recursive(row)
-                            excld_dirs.update(dirs)
-                            exclds.update(files)
-                        elif os.path.isfile(row):
-                            exclds.add(os.path.join('./', row))
-                        elif os.path.isdir(row):
-                            row = row.rstrip('/')
-                            if not row[:2] == './':
-                                row = os.path.join('./', row)
-                            excld_dirs.add(row)
-                        else:
-                            continue
-            except IOError:
-                pass
-
-            return exclds, excld_dirs
+        # Limits on the hits passed on by limit(), None for no limit
+        self.max_count = config.max_count
+        self.max_per_file = config.max_per_file
+        self.max_files = config.max_files
+
+        # Set once limit() has stopped early or left hits out
+        self.truncated = False
+
+        # Every file find_files() finds, once all_files() has listed them
+        self.found = None
+
+        if file_patterns:
+            self._include = re.compile('|'.join(
+                    fntranslate(z) for z in file_patterns
+                    ))
         else:
-            return [], []
+            self._include = None
+
+    def matches(self, path):
+        """Does the name of a file match file_patterns?"""
+        if self._include is None:
+            return True
+
+        return self._include.match(os.path.basename(path)) is not None
+
+    def find_files(self):
+        """Walk the working directory once, yielding the paths of files that
+        match file_patterns and aren't ignored. If all_files() has already
+        walked it they're not walked again."""
+        if self.found is not None:
+            return iter(self.found)
+        return stats.timed('find_files', self._find_files())
+
+    def all_files(self):
+        """List every file find_files() finds, so that a search afterwards
+        doesn't have to walk the working directory again."""
+        if self.found is None:
+            self.found = list(self.find_files())
+        return self.found
+
+    def _find_files(self):
+        if self.config.no_ignore:
+            paths = walk_files('.')
+        else:
+            paths = walk_files(
+                    '.',
+                    self.config.ignore_file or None,
+                    self.NESTED_IGNORE_FILE,
+                    self.ALWAYS_SKIP
+                    )
+
+        for path in paths:
+            if self.matches(path):
+                yield path
+
+    def changed_since(self, rev):
+        """Paths of files matching file_patterns that git says have changed
+        since a revision, including untracked files and deleted ones."""
+        cmds = [
+                ['git', '-c', 'core.quotePath=false', 'diff', '--name-only',
+                    '--relative', rev, '--'],
+                ['git', '-c', 'core.quotePath=false', 'ls-files', '--others',
+                    '--exclude-standard'],
+                ]
 
-    def grep_for(self, exp):
+        paths = set()
+        for cmd in cmds:
+            errors = child_stderr()
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+            output = proc.communicate()[0]
+            copy_stderr(errors)
+            if proc.returncode:
+                print "Whoops, couldn't list files changed since '%s'" % rev
+                sys_exit()
+
+            paths.update(
+                    './' + z for z in output.splitlines() if self.matches(z)
+                    )
+
+        return sorted(paths)
+
+    def candidates(self, exp, paths=None):
+        """The files that could contain a match for exp. That's everything
+        find_files() finds (or paths if given), unless a trigram index can
+        narrow it down."""
+        if paths is None:
+            paths = self.find_files()
+        index = TrigramIndex(self.index_key())
+        if not index.loaded:
+            return paths
+
+        trigrams = required_trigrams(exp)
+        if self.debug:
+            print "=== Trigram index ==="
+            if trigrams is None:
+                print " Can't narrow down '%s', searching everything\n" % exp
+            else:
+                print " Files containing: %s\n" % ', '.join(
+                        repr(z) for z in sorted(trigrams)
+                        )
+
+        return index.narrow(paths, trigrams)
+
+    def index_key(self):
+        """Identifies the trigram index of the files matching file_patterns."""
+        return '\0'.join(self.file_patterns)
+
+    def build_index(self):
+        """Create or refresh the trigram index of the files to search.
+        Returns the number of files in the index and how many were read."""
+        index = TrigramIndex(self.index_key())
+        read = index.update(self.find_files())
+        index.save()
+
+        return len(index.files), read
+
+    def _batches(self, paths):
+        """Split paths into lists short enough for a command line."""
+        batch = []
+        size = 0
+        for path in paths:
+            if batch and size + len(path) >= self.BATCH_BYTES:
+                yield batch
+                batch = []
+                size = 0
+            batch.append(path)
+            size += len(path) + 1
+
+        if batch:
+            yield batch
+
+    def search(self, exp, paths=None):
+        """Search for the given expression with the configured backend.
+        Yields the hits in each file, see group_rows().
+
+        If paths is given, only those files are searched and it's not an
+        error if nothing is found."""
+        backend = self.config.backend
+        if backend == 'git' and paths is not None:
+            # git grep can't be given files that it would ignore
+            backend = 'grep'
+        elif backend == 'git' and not self.in_git_work_tree():
+            if self.debug:
+                print "Not in a git work tree, searching with grep instead\n"
+            backend = 'grep'
+
+        if backend == 'python':
+            return self.search_python(exp, paths)
+        elif backend == 'git':
+            return group_rows(self.git_grep_for(exp))
+        else:
+            return group_rows(self.grep_for(exp, paths))
+
+    def limit(self, groups):
+        """
+        Pass on the hits in each file (see search()) until max_count hits or
+        max_files files have been found, keeping no more than max_per_file
+        hits from each file. As soon as a limit is reached, the search is
+        stopped (which kills grep) and truncated is set.
+        """
+        count = 0
+        files = 0
+        try:
+            for file_path, file_lines, line_texts, lines in groups:
+                keep = len(file_lines)
+                if self.max_per_file is not None:
+                    keep = min(keep, self.max_per_file)
+                    if keep == self.max_per_file:
+                        # Backends stop reading a file at the limit, so
+                        # there may well be more
+                        self.truncated = True
+                if self.max_count is not None:
+                    keep = min(keep, self.max_count - count)
+
+                if keep < len(file_lines):
+                    self.truncated = True
+                    file_lines = file_lines[:keep]
+                    line_texts = line_texts[:keep]
+                if keep:
+                    yield file_path, file_lines, line_texts, lines
+                count += keep
+                files += 1
+
+                if ((self.max_count is not None and count >= self.max_count) or
+                        (self.max_files is not None and files >= self.max_files)):
+                    self.truncated = True
+                    if self.debug:
+                        print "=== Limit reached after %d hits in %d files ===\n" % (
+                                count,
+                                files
+                                )
+                    return
+        finally:
+            if hasattr(groups, 'close'):
+                groups.close()
+
+    def search_python(self, exp, paths=None):
         """
-        Execute a grep command to search for the given expression.
-        Results are returned as a list.
+        Search for the given expression without leaving this process.
+        Unlike grep, this uses python's regex syntax (the same as -F and
+        intersections). The lines of each file with hits are passed along so
+        the reader doesn't have to read the file again.
         """
-        cmd = self._grep_cmd(exp, self.file_patterns)
+        flags = re.MULTILINE | (re.IGNORECASE if self.config.case_off else 0)
+        try:
+            regex = re.compile(exp, flags)
+        except re.error, err:
+            print "Whoops, couldn't compile '%s': %s" % (exp, err)
+            sys_exit()
+
+        if self.debug:
+            print "=== Python search ==="
+            print " re.compile(%r, %d)\n" % (exp, flags)
+            print "=== Search results ==="
+
+        count = 0
+        files = 0
+        for file_path in self.candidates(exp, paths):
+            files += 1
+            hits = self.search_file(regex, file_path, self.max_per_file)
+            if hits is None:
+                continue
+
+            file_lines, line_texts, lines = hits
+            if self.debug:
+                for line_number, line_text in zip(file_lines, line_texts):
+                    print "%s:%d:%s" % (file_path, line_number, line_text)
+            count += len(file_lines)
+            yield file_path, file_lines, line_texts, lines
+
+        if self.debug:
+            print "Total results: %d (from %d files)\n" % (count, files)
+
+        if count == 0 and paths is None:
+            print "Couldn't find anything matching '%s'" % exp
+            sys_exit()
+
+    @staticmethod
+    def search_file(regex, file_path, max_count=None):
+        """
+        Find the lines in a file that match regex, the same way grep would
+        (stopping after max_count lines if given). Returns (file_lines,
+        line_texts, lines) or None if nothing matched or the file looks
+        binary.
+
+        The file is scanned through mmap so files without any hits are never
+        copied into memory.
+        """
+        try:
+            with open(file_path, 'rb') as inp:
+                size = os.fstat(inp.fileno()).st_size
+                stats.count('files_opened')
+                if not size:
+                    return None
+                buf = mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+                stats.count('bytes_read', size)
+        except (IOError, OSError, mmap.error):
+            return None
+
+        try:
+            match = regex.search(buf)
+            if match is None or buf.find('\x00') != -1:
+                return None
+            text = buf[:]
+        finally:
+            buf.close()
+
+        # A newline at the very end doesn't start another line
+        end = len(text) - 1 if text.endswith('\n') else len(text)
+
+        file_lines = []
+        line_texts = []
+        line_number = 1
+        counted = 0
+        while match is not None and match.start() <= end:
+            start = match.start()
+            line_start = text.rfind('\n', 0, start) + 1
+            line_end = text.find('\n', start)
+            if line_end == -1:
+                line_end = len(text)
+            line_text = text[line_start:line_end]
+
+            # Matches can run over the end of a line, grep wouldn't allow that
+            if regex.search(line_text) is None:
+                if start < len(text):
+                    match = regex.search(text, start + 1)
+                else:
+                    match = None
+                continue
+
+            line_number += text.count('\n', counted, line_start)
+            counted = line_start
+            file_lines.append(line_number)
+            line_texts.append(line_text)
+            if len(file_lines) == max_count:
+                break
+
+            match = regex.search(text, line_end + 1)
+
+        if not file_lines:
+            return None
+
+        return file_lines, line_texts, StringIO(text).readlines()
+
+    def grep_for(self, exp, paths=None):
+        """
+        Execute grep commands to search for the given expression (in paths
+        if given). Results are yielded one line at a time while grep is still
+        running.
+
+        With more than one job, the files are split into shards and a grep
+        process is run for each shard at the same time.
+        """
+        cmd = self._grep_cmd(exp)
+        jobs = self.config.jobs or cpu_count()
 
         if self.debug:
             print "=== Grep command ==="
-            print " $ %s\n" % cmd
+            print " $ %s FILES...\n" % ' '.join(quote(z) for z in cmd)
+            if jobs > 1:
+                print "(in %d shards)\n" % jobs
+            print "=== Grep results ==="
+
+        candidates = self.candidates(exp, paths)
+        if jobs == 1:
+            rows = self._grep_files(cmd, candidates)
+        else:
+            rows = self._grep_sharded(cmd, candidates, jobs)
+
+        for row in self._check_rows(rows, exp, paths is None):
+            yield row
+
+    def git_grep_for(self, exp):
+        """
+        Execute git grep to search for the given expression in the files git
+        knows about (tracked files and untracked ones that aren't ignored).
+        Results are yielded one line at a time while git is still running.
+
+        git grep --untracked leaves out tracked files that match an ignore
+        rule, so tracked files are searched first and then untracked ones
+        that git ls-files says aren't ignored.
+        """
+        cmd = self._git_grep_cmd(exp)
+        pathspecs = self._git_pathspecs()
+
+        if self.config.no_ignore:
+            # Everything, tracked or not
+            first = cmd + ['--untracked', '--no-exclude-standard']
+        else:
+            first = cmd
+        first = first + ['--'] + pathspecs
+
+        if self.debug:
+            print "=== Git grep command ==="
+            print " $ %s\n" % ' '.join(quote(z) for z in first)
+            if not self.config.no_ignore:
+                print "(then untracked files that aren't ignored)\n"
+            print "=== Grep results ==="
+
+        rows = self._run(first)
+        if not self.config.no_ignore:
+            untracked = (':(literal)' + z for z in self.git_untracked(pathspecs))
+            rows = chain(
+                    rows, self._grep_files(cmd + ['--untracked', '--'], untracked))
+
+        # Paths are relative to the current directory, like grep's
+        rows = ('./' + z for z in rows)
+
+        for row in self._check_rows(rows, exp):
+            yield row
+
+    def _check_rows(self, rows, exp, required=True):
+        """Pass rows from grep through, printing them in debug mode and
+        explaining what went wrong if grep failed or found nothing (when
+        something was required). grep also fails when it couldn't read some
+        of the files, that's only fatal if it didn't find anything else."""
+        count = 0
+        try:
+            for row in rows:
+                if self.debug:
+                    print row
+                count += 1
+                yield row
+        except GrepError, err:
+            if not count:
+                print "Whoops, grep returned errorcode %d" % err.returncode
+                sys_exit()
+            if self.debug:
+                print "(grep returned errorcode %d)" % err.returncode
+
+        if self.debug:
+            print "Total results: %d\n" % count
+
+        if count == 0 and required:
+            print "Couldn't find anything matching '%s'" % exp
+            sys_exit()
+
+    @staticmethod
+    def _run(cmd, procs=None):
+        """Run a grep command, yielding rows of output as they arrive.
+        Raises GrepError if grep fails. The process is added to procs if
+        it's given, so another thread can kill it."""
+        errors = child_stderr()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        if procs is not None:
+            procs.append(proc)
+
+        try:
+            for row in iter(proc.stdout.readline, ''):
+                yield row.rstrip('\r\n')
+
+            returncode = proc.wait()
+        finally:
+            # Don't leave grep running if we stop reading early
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            copy_stderr(errors)
 
+        if returncode > 1:
+            raise GrepError(returncode)
+
+    def _grep_files(self, cmd, paths, procs=None):
+        """Run grep over paths (a batch at a time), yielding rows of output.
+        If grep fails on a batch the rest are still searched, then GrepError
+        is raised at the end. See _run() for procs."""
+        error = None
+        for batch in self._batches(paths):
+            try:
+                for row in self._run(cmd + batch, procs):
+                    yield row
+            except GrepError, err:
+                error = err
+
+        if error is not None:
+            raise error
+
+    def _grep_sharded(self, cmd, paths, jobs):
+        """Run a grep process for each shard of paths at once, yielding rows
+        in the same order as a single grep would. Each shard reads no more
+        than READ_AHEAD files ahead, and every grep is killed as soon as the
+        rows stop being read."""
+        paths = list(paths)
+        shards = self.shard_files(paths, jobs)
+        order = {path: indx for indx, path in enumerate(paths)}
+        owner = {}
+        for shard_indx, shard in enumerate(shards):
+            for path in shard:
+                owner[order[path]] = shard_indx
+
+        # Each shard hands over (path index, rows) for each file with hits,
+        # in order, then (done, None)
+        queues = [Queue(self.READ_AHEAD) for _ in shards]
+        procs = []
+        stop = Event()
+        done = len(paths)
+
+        def put(queue, item):
+            # Give up if nothing is reading any more
+            while not stop.is_set():
+                try:
+                    queue.put(item, True, 0.1)
+                    return
+                except Full:
+                    pass
+
+        def worker(queue, paths):
+            rows = self._grep_files(cmd, paths, procs)
+            group = []
+            current = None
+            try:
+                for row in rows:
+                    if stop.is_set():
+                        return
+
+                    # Hand over each file's rows once they're all in
+                    file_path = row.split(':', 1)[0]
+                    if group and file_path != current:
+                        put(queue, (order[current], group))
+                        group = []
+                    current = file_path
+                    group.append(row)
+
+                if group:
+                    put(queue, (order[current], group))
+            except GrepError, err:
+                put(queue, err)
+            finally:
+                rows.close()
+                put(queue, (done, None))
+
+        threads = []
+        for queue, shard in zip(queues, shards):
+            thread = Thread(target=worker, args=(queue, shard))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        heads = [None] * len(shards)
+        errors = []
+
+        def head(shard_indx):
+            """The next file with hits from a shard, waiting for it."""
+            while heads[shard_indx] is None:
+                # Waiting with a timeout keeps this interruptible
+                try:
+                    item = queues[shard_indx].get(True, 0.1)
+                except Empty:
+                    continue
+                if isinstance(item, GrepError):
+                    errors.append(item)
+                else:
+                    heads[shard_indx] = item
+            return heads[shard_indx]
+
+        try:
+            for indx in xrange(done):
+                # Files without hits are passed over by their shard's grep
+                shard_indx = owner[indx]
+                if head(shard_indx)[0] == indx:
+                    for row in heads[shard_indx][1]:
+                        yield row
+                    heads[shard_indx] = None
+
+            # Wait for every grep to finish, in case any failed
+            for shard_indx in xrange(len(shards)):
+                head(shard_indx)
+        finally:
+            stop.set()
+            for proc in procs:
+                if proc.poll() is None:
+                    try:
+                        proc.kill()
+                    except OSError:
+                        pass
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+
+    @staticmethod
+    def shard_files(paths, count):
+        """Split paths into up to count lists holding roughly the same number
+        of bytes each. Paths keep their original order within each list."""
+        sized = []
+        for indx, path in enumerate(paths):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            sized.append((size, indx, path))
+
+        # Biggest files first, each to whichever shard is smallest so far
+        shards = [(0, z, []) for z in range(min(count, len(sized)))]
+        for size, indx, path in sorted(sized, reverse=True):
+            total, shard_indx, shard = heappop(shards)
+            shard.append((indx, path))
+            heappush(shards, (total + size, shard_indx, shard))
+
+        return [[path for _, path in sorted(shard)] for _, _, shard in shards]
+
+    @staticmethod
+    def in_git_work_tree():
+        """Is the current directory inside a git work tree?"""
         try:
-            response = subprocess.check_output(
-                    [cmd],
-                    shell=True
+            proc = subprocess.Popen(
+                    ['git', 'rev-parse', '--is-inside-work-tree'],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
                     )
-            results = response.splitlines()
+        except OSError:
+            # No git installed
+            return False
 
-            if self.debug:
-                print "=== Grep results ==="
-                print response, "Total results: %d\n" % len(results)
-        except subprocess.CalledProcessError, err:
-            if err.returncode == 1:
-                print "Couldn't find anything matching '%s'" % exp
-            else:
-                print "Whoops, grep returned errorcode %d" % err.returncode
+        return proc.communicate()[0].strip() == 'true'
+
+    def git_untracked(self, pathspecs):
+        """Paths of the untracked files matching pathspecs that git doesn't
+        ignore, relative to the current directory."""
+        cmd = ['git', 'ls-files', '-z', '--others', '--exclude-standard', '--']
+        errors = child_stderr()
+        proc = subprocess.Popen(
+                cmd + pathspecs, stdout=subprocess.PIPE, stderr=errors)
+        output = proc.communicate()[0]
+        copy_stderr(errors)
+        if proc.returncode:
+            print "Whoops, couldn't list untracked files"
             sys_exit()
 
-        return results
+        return [z for z in output.split('\0') if z]
 
-    def _grep_cmd(self, exp, file_patterns):
-        """Build the grep command used to perform search."""
-        exclds, excld_dirs = self.get_exclds()
+    def _git_grep_cmd(self, exp):
+        """Build the git grep command used to perform search (without the
+        pathspecs of files to search)."""
+        cmd = list(self.GIT_GREP_CMD)
 
-        if self.debug:
-            print "=== Excluded files ==="
-            for exf in exclds:
-                print exf
-            print
-            print "=== Excluded dirs ==="
-            for exd in excld_dirs:
-                print exd
-            print
-
-        # Turn list of excluded files into string of CLI flags
-        exclds = ''.join([self.EXCLUDES_TEMPLATE % z for z in exclds])
-        excld_dirs = ''.join(
-                [self.EXCLUDE_DIRS_TEMPLATE % z for z in excld_dirs]
-                )
-        excld_flags = exclds + excld_dirs
-
-        # Turn list of included filetypes into string of CLI flags
-        inclds = ' '.join([self.INCLUDES_TEMPLATE % z for z in file_patterns])
+        # Other features to enable during the search
+        if self.config.case_off:
+            cmd.append('-i')
+        if self.config.jobs != 1:
+            cmd.append('--threads=%d' % (self.config.jobs or cpu_count()))
+
+        return cmd + ['-e', exp]
+
+    def _git_pathspecs(self):
+        """Pathspecs for the files to search with git."""
+        # Match the base name of files at any depth, like --include
+        pathspecs = [':(glob)**/' + z for z in self.file_patterns] or ['.']
+        for skip in self.ALWAYS_SKIP:
+            pathspecs.append(':(exclude)' + skip)
+
+        return pathspecs
+
+    def _grep_cmd(self, exp):
+        """Build the grep command used to perform search (without the list
+        of files to search)."""
+        cmd = list(self.GREP_CMD)
 
         # Other features to enable during the search
-        other_flags = 'i' if self.config.case_off else ''
+        if self.config.case_off:
+            cmd.append('-i')
+        if self.max_per_file is not None:
+            cmd.append('--max-count=%d' % self.max_per_file)
 
-        return self.GREP_TEMPLATE % (other_flags, exp, excld_flags, inclds)
+        return cmd + ['-e', exp, '--']
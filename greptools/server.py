@@ -0,0 +1,289 @@
+"""A long running process that does the work of the greptools for thin clients
+(see greptools.client) over a Unix domain socket.
+
+Staying alive between searches saves starting python each time and keeps
+outlines, ignore rules and trigram indexes in memory. Searches are handled one
+at a time because each one runs in the client's working directory."""
+import os
+import socket
+import sys
+import traceback
+
+from argparse import ArgumentParser
+from SocketServer import ThreadingMixIn, StreamRequestHandler, UnixStreamServer
+from threading import Condition, Lock, Thread
+
+from greptools import reader
+from greptools.base import GrepTools
+from greptools.cache import OutlineCache
+from greptools.client import (connect, is_own_socket, recv_message,
+                              send_message, socket_path)
+from greptools.reader.reader import BaseReader
+
+def reader_class(name):
+    """The reader class a client asked for, or None if greptools.reader
+    doesn't have it (e.g. it was added after the server started)."""
+    cls = getattr(reader, name, None)
+    if isinstance(cls, type) and issubclass(cls, BaseReader):
+        return cls
+    return None
+
+def exit_status(err):
+    """The status a process would exit with for a SystemExit, writing any
+    message to stderr like python does."""
+    if err.code is None:
+        return 0
+    if isinstance(err.code, int):
+        return err.code
+    print >> sys.stderr, err.code
+    return 1
+
+class RemoteInput(object):
+    """What the client has on stdin. It arrives a chunk at a time (see feed())
+    while it's being read, reads wait for enough of it to arrive."""
+
+    def __init__(self, tty):
+        self.tty = tty
+        self.chunks = []
+        self.size = 0
+        self.finished = tty
+        self.arrived = Condition()
+
+    def isatty(self):
+        return self.tty
+
+    def feed(self, chunk):
+        """Add a chunk of input, an empty one marks the end."""
+        with self.arrived:
+            if chunk:
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+            else:
+                self.finished = True
+            self.arrived.notify_all()
+
+    def wait(self):
+        """Wait until there's something to read, or the end."""
+        with self.arrived:
+            while not (self.chunks or self.finished):
+                self.arrived.wait()
+
+    def read(self, size=-1):
+        with self.arrived:
+            while not self.finished and (size < 0 or self.size < size):
+                self.arrived.wait()
+            return self._take(size)
+
+    def readline(self):
+        with self.arrived:
+            while True:
+                data = ''.join(self.chunks)
+                self.chunks = [data] if data else []
+                end = data.find('\n') + 1
+                if end or self.finished:
+                    return self._take(end or -1)
+                self.arrived.wait()
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def _take(self, size):
+        """Remove up to size bytes (all of it if size is negative) from the
+        start of what's arrived and return them."""
+        data = ''.join(self.chunks)
+        if size < 0:
+            size = len(data)
+        head, rest = data[:size], data[size:]
+        self.chunks = [rest] if rest else []
+        self.size = len(rest)
+        return head
+
+class RemoteOutput(object):
+    """Sends everything written for the client's stdout or stderr on to it as
+    it's written (name says which). It's buffered the way python buffers them,
+    stderr not at all and stdout by line for a terminal or else in blocks."""
+    BUFFER_SIZE = 8192
+
+    def __init__(self, send, name, tty):
+        self.send = send
+        self.name = name
+        self.tty = tty
+        self.buffer_size = self.BUFFER_SIZE if name == 'stdout' else 0
+        self.chunks = []
+        self.size = 0
+        self.softspace = 0
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size > self.buffer_size or (self.tty and '\n' in data):
+            self.flush()
+
+    def flush(self):
+        if self.size:
+            data = ''.join(self.chunks)
+            self.chunks = []
+            self.size = 0
+            self.send({self.name: data})
+
+class SearchHandler(StreamRequestHandler):
+    """Runs one greptool for a client.
+
+    Clients say which reader they want first, so that they can search
+    locally if the server doesn't have it, before sending the rest of the
+    request. Then their stdin follows in {'stdin': chunk} messages as it
+    arrives (an empty chunk at the end) and output is sent back in
+    {'stdout': data} and {'stderr': data} messages as it's written, followed
+    by {'status': status}.
+
+    Searches are run one at a time. A client's stdin may be the output of
+    another client (e.g. `pygt a | pygt b`), so it's always read as it
+    arrives and a search doesn't wait for its turn until some has arrived."""
+    lock = Lock()
+
+    def setup(self):
+        StreamRequestHandler.setup(self)
+        self.sending = Lock()
+
+    def send(self, data):
+        """Send a message to the client, from any thread."""
+        with self.sending:
+            send_message(self.connection, data)
+
+    def handle(self):
+        request = recv_message(self.connection)
+        reader_cls = reader_class(request['reader'])
+        self.send({'known': reader_cls is not None})
+        if reader_cls is None:
+            return
+
+        request.update(recv_message(self.connection))
+        stdin = RemoteInput(request['stdin_tty'])
+        stdout = RemoteOutput(self.send, 'stdout', request['stdout_tty'])
+        stderr = RemoteOutput(self.send, 'stderr', request['stderr_tty'])
+
+        if not stdin.isatty():
+            receiver = Thread(target=self.receive_input, args=(stdin,))
+            receiver.daemon = True
+            receiver.start()
+            stdin.wait()
+
+        with self.lock:
+            status = self.search(reader_cls, request, stdin, stdout, stderr)
+
+        try:
+            stdout.flush()
+            stderr.flush()
+            self.send({'status': status})
+        except socket.error:
+            # The client has gone
+            pass
+
+    def receive_input(self, stdin):
+        """Feed stdin with what the client sends of it's stdin."""
+        try:
+            while True:
+                chunk = recv_message(self.connection)['stdin']
+                if not chunk:
+                    break
+                stdin.feed(chunk)
+        except (socket.error, EOFError, ValueError):
+            # The client has gone, there's no more to come
+            pass
+        finally:
+            stdin.feed('')
+
+    @staticmethod
+    def search(reader_cls, request, stdin, stdout, stderr):
+        """Run the greptool in the client's working directory, returns the
+        status it would have exited with."""
+        cwd = os.getcwd()
+        real_stdout = sys.stdout
+        real_stderr = sys.stderr
+        status = 0
+        try:
+            os.chdir(request['cwd'])
+            sys.stdout = stdout
+            sys.stderr = stderr
+            GrepTools(reader_cls, request['argv'], stdin, stdout, stderr)
+        except SystemExit, err:
+            status = exit_status(err)
+        except socket.error:
+            # The client has gone (e.g. it's output was piped to head)
+            status = 1
+        except Exception:
+            traceback.print_exc(file=stderr)
+            status = 1
+        finally:
+            sys.stdout = real_stdout
+            sys.stderr = real_stderr
+            os.chdir(cwd)
+
+        return status
+
+class GrepServer(ThreadingMixIn, UnixStreamServer):
+    """Listens for searches on a Unix domain socket."""
+    daemon_threads = True
+
+    def __init__(self, path=None):
+        self.path = socket_path() if path is None else path
+
+        # Clear up after a server that didn't exit cleanly
+        if os.path.lexists(self.path):
+            if not is_own_socket(self.path):
+                raise RuntimeError(
+                        "%s is already there and isn't our socket" % self.path
+                        )
+            sock = connect(self.path)
+            if sock is not None:
+                sock.close()
+                raise RuntimeError("Already running on %s" % self.path)
+            os.remove(self.path)
+
+        OutlineCache.keep_in_memory()
+
+        umask = os.umask(0077)
+        try:
+            UnixStreamServer.__init__(self, self.path, SearchHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def main(argv):
+    """Run a server until it's interrupted."""
+    parser = ArgumentParser(description="Serve searches for the greptools.")
+    parser.add_argument(
+            '-s',
+            '--socket',
+            default=None,
+            type=str,
+            help="Path of the socket to listen on (default: %s)."
+                    % socket_path(),
+            dest='socket'
+            )
+    config = parser.parse_args(argv[1:])
+
+    try:
+        server = GrepServer(config.socket)
+    except RuntimeError, err:
+        print err
+        return
+
+    print "Listening on %s" % server.path
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
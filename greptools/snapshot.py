@@ -0,0 +1,62 @@
+"""Saved result trees that can be brought up to date without searching every
+file again (see BaseReader.refresh()).
+
+A snapshot is a GrepTree saved as json by dump_to_path(). Next to it is a
+manifest recording the query that produced it and the size and mtime of every
+file that was searched at the time.
+"""
+import json
+import os
+import time
+
+from greptools.cache import MIN_AGE, fingerprint
+from greptools.greptree import GrepTree
+
+def fingerprints(paths):
+    """Map each path to it's fingerprint, skipping files that have gone.
+    Files modified too recently (see MIN_AGE) get None, so they're searched
+    again next time."""
+    now = time.time()
+    prints = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+
+        if now - stat.st_mtime < MIN_AGE:
+            prints[path] = None
+        else:
+            prints[path] = fingerprint(stat)
+
+    return prints
+
+class Snapshot(object):
+    """A GrepTree saved at path, along with it's manifest."""
+    MANIFEST_SUFFIX = '.manifest'
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = path + self.MANIFEST_SUFFIX
+
+    def load(self, query):
+        """Returns the saved (tree, fingerprints) or (None, None) if there's
+        no snapshot or it was made by a different query."""
+        try:
+            with open(self.manifest_path) as inp:
+                manifest = json.load(inp)
+            tree = GrepTree.load_path(self.path)
+        except (IOError, ValueError):
+            return None, None
+
+        if manifest.get('query') != query:
+            return None, None
+
+        return tree, manifest['files']
+
+    def save(self, tree, query, files):
+        """Save a tree along with the query that made it and the fingerprints
+        of the files that were searched."""
+        tree.dump_to_path(self.path)
+        with open(self.manifest_path, 'w') as outp:
+            json.dump({'query': query, 'files': files}, outp)
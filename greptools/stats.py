@@ -0,0 +1,215 @@
+"""Timings and counters for the stages of a search (see --stats).
+
+stage(), timed() and count() do nothing until collecting is switched on with
+start(), so they're left in place throughout the package. Stages can nest and
+the time of each one includes the stages inside it. Only one search is
+measured at a time, which is all a greptool (or the server) ever runs.
+
+CPU time comes from getrusage() for the whole process, so a stage that runs
+while another thread is busy (e.g. 'load' while a union or XOR search runs in
+the background) includes that thread's work too. The trace format shows which
+thread each stage ran on."""
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+from thread import get_ident
+
+# Formats that Stats.report() can write
+FORMATS = ['text', 'json', 'trace']
+
+_current = None
+
+def cpu_time():
+    """User and system time of this process and it's children that have
+    finished (e.g. grep)."""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+
+    return total
+
+def start():
+    """Start collecting, returns the new Stats."""
+    global _current
+    _current = Stats()
+    return _current
+
+def stop():
+    """Stop collecting, returns what was collected (or None)."""
+    global _current
+    stats, _current = _current, None
+    return stats
+
+@contextmanager
+def stage(name):
+    """Time everything done inside a with block as a stage called name."""
+    if _current is None:
+        yield
+        return
+
+    began = _current.begin()
+    try:
+        yield
+    finally:
+        _current.end(name, began)
+
+def timed(name, iterable):
+    """Time the work done producing each item of iterable (but not what's
+    done with them) as a stage called name."""
+    if _current is None:
+        return iterable
+
+    return _current.timed(name, iterable)
+
+def count(name, amount=1):
+    """Add to one of the counters."""
+    if _current is not None:
+        _current.counters[name] = _current.counters.get(name, 0) + amount
+
+class Stats(object):
+    """Wall and CPU time spent in each stage, along with counters.
+
+    Each time a stage runs it's also kept as an event for the trace format,
+    along with the thread it ran on, up to MAX_EVENTS of them."""
+    MAX_EVENTS = 100000
+
+    def __init__(self):
+        self.started = (time.time(), cpu_time())
+        self.stages = {}
+        self.order = []
+        self.counters = {}
+        self.events = []
+        self.dropped = 0
+
+        # Small ids for the threads stages have run on, the one collecting
+        # started on is 0 and the others are numbered as they turn up
+        self.threads = {get_ident(): 0}
+
+    @staticmethod
+    def begin():
+        return time.time(), cpu_time()
+
+    def end(self, name, began):
+        """Record a stage that ran from began (see begin()) until now."""
+        wall, cpu = time.time(), cpu_time()
+        totals = self.stages.get(name)
+        if totals is None:
+            totals = self.stages[name] = [0, 0.0, 0.0]
+            self.order.append(name)
+        totals[0] += 1
+        totals[1] += wall - began[0]
+        totals[2] += cpu - began[1]
+
+        if len(self.events) < self.MAX_EVENTS:
+            tid = self.threads.setdefault(get_ident(), len(self.threads))
+            self.events.append(
+                    (name, tid, began[0], wall - began[0], cpu - began[1])
+                    )
+        else:
+            self.dropped += 1
+
+    def timed(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            began = self.begin()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.end(name, began)
+                return
+            self.end(name, began)
+            yield item
+
+    def totals(self):
+        """(wall, cpu) since collecting started."""
+        return (time.time() - self.started[0], cpu_time() - self.started[1])
+
+    def to_dict(self):
+        """Everything collected, as written by the json format."""
+        wall, cpu = self.totals()
+        return {
+                'wall': wall,
+                'cpu': cpu,
+                'stages': [
+                        {
+                            'name': name,
+                            'calls': self.stages[name][0],
+                            'wall': self.stages[name][1],
+                            'cpu': self.stages[name][2],
+                        }
+                        for name in self.order
+                        ],
+                'counters': self.counters,
+                }
+
+    def to_trace(self):
+        """Everything collected in Chrome's trace event format (load it in
+        chrome://tracing or Perfetto)."""
+        pid = os.getpid()
+        micros = lambda z: int(z * 1000000)
+        origin = self.started[0]
+        events = [
+                {
+                    'name': name,
+                    'ph': 'X',
+                    'pid': pid,
+                    'tid': tid,
+                    'ts': micros(began - origin),
+                    'dur': micros(wall),
+                    'args': {'cpu_us': micros(cpu)},
+                }
+                for name, tid, began, wall, cpu in self.events
+                ]
+        events.append({
+                'name': 'counters',
+                'ph': 'C',
+                'pid': pid,
+                'tid': 0,
+                'ts': micros(time.time() - origin),
+                'args': self.counters,
+                })
+
+        return {
+                'traceEvents': events,
+                'displayTimeUnit': 'ms',
+                'otherData': {'dropped_events': self.dropped},
+                }
+
+    def to_text(self):
+        """A table of stages and counters for people to read."""
+        wall, cpu = self.totals()
+        width = max([len(z) for z in self.order + self.counters.keys()] + [5])
+        row = '%%-%ds %%7s %%10s %%10s' % width
+
+        lines = ["=== Stats ==="]
+        lines.append(row % ('stage', 'calls', 'wall', 'cpu'))
+        for name in self.order:
+            calls, stage_wall, stage_cpu = self.stages[name]
+            lines.append(row % (
+                    name,
+                    calls,
+                    '%.4fs' % stage_wall,
+                    '%.4fs' % stage_cpu
+                    ))
+        lines.append(row % ('total', '', '%.4fs' % wall, '%.4fs' % cpu))
+
+        if self.counters:
+            lines.append('')
+            for name in sorted(self.counters):
+                lines.append('%%-%ds %%7d' % width % (name, self.counters[name]))
+
+        return '\n'.join(lines) + '\n'
+
+    def report(self, outp, format_='text'):
+        """Write everything collected to a file object in one of FORMATS."""
+        if format_ == 'json':
+            json.dump(self.to_dict(), outp, indent=4, sort_keys=True)
+            outp.write('\n')
+        elif format_ == 'trace':
+            json.dump(self.to_trace(), outp)
+            outp.write('\n')
+        else:
+            outp.write(self.to_text())
@@ -0,0 +1,63 @@
+import os
+import shutil
+import unittest
+
+from tempfile import mkdtemp
+
+from ..bench import (READERS, benchmarks, compare, generate, growth_exponent,
+                     in_corpus, make_config, QUERY)
+from ..reader import PythonReader
+from ..searcher import Searcher
+
+class TestCorpus(unittest.TestCase):
+    def test_generate(self):
+        """Every reader should find each hit nested depth contexts deep."""
+        for reader_type, reader_cls in sorted(READERS.iteritems()):
+            with in_corpus(reader_type, files=3, depth=4, hits=3, lines=60) as env:
+                tree = reader_cls(make_config()).build_tree(QUERY)
+
+            self.assertEqual(env.hits, 9)
+            self.assertEqual(tree._count, 9, reader_type)
+            for keys, lines in tree.walk():
+                if lines:
+                    # File path plus one key per scope
+                    self.assertEqual(len(keys), 5, (reader_type, keys))
+
+    def test_git(self):
+        """The git benchmarks should only run in a git work tree."""
+        for git in (False, True):
+            with in_corpus('Python', git=git, files=2):
+                self.assertEqual(Searcher.in_git_work_tree(), git)
+                names = [z[0] for z in benchmarks(PythonReader)]
+            self.assertEqual('reader/git' in names, git)
+
+    def test_seed(self):
+        """The same options should always generate the same files."""
+        roots = [mkdtemp(), mkdtemp()]
+        try:
+            for root in roots:
+                generate(root, 'Python', files=2, seed=3)
+            with open(os.path.join(roots[0], 'pkg1', 'mod1.py')) as inp:
+                first = inp.read()
+            with open(os.path.join(roots[1], 'pkg1', 'mod1.py')) as inp:
+                self.assertEqual(inp.read(), first)
+        finally:
+            for root in roots:
+                shutil.rmtree(root)
+
+class TestResults(unittest.TestCase):
+    def test_growth_exponent(self):
+        self.assertAlmostEqual(growth_exponent([1, 2, 4], [5, 1, 2]), 1.0)
+        self.assertAlmostEqual(growth_exponent([1, 2, 4], [1, 4, 16]), 2.0)
+
+    def test_compare(self):
+        results = [
+                {'commit': 'aaaa111', 'name': 'a', 'best': 1.0},
+                {'commit': 'aaaa111', 'name': 'b', 'best': 1.0},
+                {'commit': 'bbbb222-dirty', 'name': 'a', 'best': 3.0},
+                {'commit': 'bbbb222-dirty', 'name': 'a', 'best': 2.0},
+                ]
+        self.assertEqual(compare(results, 'aaaa', 'bbbb'), [('a', 1.0, 2.0)])
+
+if __name__ == "__main__":
+    unittest.main()
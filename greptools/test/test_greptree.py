@@ -1,5 +1,9 @@
 import unittest
 
+from StringIO import StringIO
+
+from ..greptree import GrepTree, MAGIC, _HEADER
+
 class TestGrepTree(unittest.TestCase):
     """TODO: This all needs to be implemented."""
 
@@ -11,7 +15,148 @@ class TestGrepTree(unittest.TestCase):
         pass
 
     def test_append(self):
-        pass
+        tree = GrepTree()
+        tree.append('a.py', 1, 'import os', [])
+        tree.append('a.py', 5, '    os.sep', ['def b'])
+        tree.append('a.py', 9, '        os.sep', ['class C', 'def d'])
+
+        expected = {'a.py': {
+            'lines': [(1, 'import os')],
+            'def b': {'lines': [(5, '    os.sep')]},
+            'class C': {'def d': {'lines': [(9, '        os.sep')]}},
+            }}
+        self.assertEqual(tree.data, expected)
+        self.assertEqual(tree._count, 3)
+        self.assertEqual(tree.touch('a.py').count, 3)
+        self.assertEqual(tree.touch_path(['a.py', 'class C']).count, 1)
+
+    def test_round_trip(self):
+        """Converting to and from nested dicts shouldn't change anything."""
+        data = {'a.py': {
+            'lines': [[1, 'import os']],
+            'def b': {'lines': [[5, '    os.sep'], [6, '    os.sep']]},
+            }}
+        tree = GrepTree(data)
+
+        self.assertEqual(tree._count, 3)
+        self.assertEqual(GrepTree(tree.data).data, tree.data)
+
+    def test_binary_round_trip(self):
+        """Trees should survive the binary format and be recognised by load."""
+        tree = GrepTree()
+        tree.append('a.py', 1, 'import os', [])
+        tree.append('a.py', 5, '    os.sep', ['def b'])
+        tree.append('b.py', 9, '        os.sep', ['class C', 'def b'])
+
+        outp = StringIO()
+        tree.dump_binary(outp)
+        loaded = GrepTree.load(StringIO(outp.getvalue()))
+
+        self.assertEqual(loaded.data, tree.data)
+        self.assertEqual(loaded._count, 3)
+
+    def test_binary_truncated(self):
+        """Incomplete input should raise a ValueError like bad json does."""
+        tree = GrepTree()
+        tree.append('a.py', 1, 'import os', [])
+
+        outp = StringIO()
+        tree.dump_binary(outp)
+
+        with self.assertRaises(ValueError):
+            GrepTree.load(StringIO(outp.getvalue()[:-3]))
+
+    def test_set_lines_and_prune(self):
+        """Counts should be kept up to date as lines are removed."""
+        tree = GrepTree()
+        tree.append('a.py', 5, '    os.sep', ['def b'])
+        tree.append('a.py', 9, '    os.sep', ['def d'])
+
+        tree.set_lines(['a.py', 'def b'], [])
+        self.assertEqual(tree._count, 1)
+        self.assertEqual(tree.touch('a.py').count, 1)
+
+        tree.prune(['a.py', 'def b'])
+        tree.prune(['a.py', 'def d'])
+        self.assertEqual(tree.data,
+                         {'a.py': {'def d': {'lines': [(9, '    os.sep')]}}})
+
+    def test_json_utf8(self):
+        """Trees loaded from json should hold utf-8 str like searched ones."""
+        tree = GrepTree()
+        tree.append('a.py', 1, '    x = "caf\xc3\xa9"', ['def caf\xc3\xa9_x'])
+        outp = StringIO()
+        tree.dump(outp)
+
+        loaded = GrepTree.load(StringIO(outp.getvalue()))
+        self.assertEqual(list(loaded.keys()), list(tree.keys()))
+        for path, line_number, line_text in loaded.keys():
+            self.assertTrue(all(type(z) is str for z in path + (line_text,)))
+
+    def test_binary_truncated_flag(self):
+        """Trees cut short by a limit should stay marked as truncated."""
+        tree = GrepTree()
+        tree.append('a.py', 1, 'x', [])
+        outp = StringIO()
+        tree.dump_binary(outp)
+        self.assertFalse(GrepTree.loads_binary(outp.getvalue()).truncated)
+
+        tree.truncated = True
+        outp = StringIO()
+        tree.dump_binary(outp)
+        loaded = GrepTree.loads_binary(outp.getvalue())
+        self.assertTrue(loaded.truncated)
+        self.assertEqual(loaded.data, tree.data)
+
+    def test_binary_versions(self):
+        """Trees from before the T record should still load, ones from a
+        newer version shouldn't."""
+        tree = GrepTree()
+        tree.append('a.py', 1, 'x', [])
+        outp = StringIO()
+        tree.dump_binary(outp)
+        body = outp.getvalue()[_HEADER.size:]
+
+        loaded = GrepTree.loads_binary(_HEADER.pack(MAGIC, 1) + body)
+        self.assertEqual(loaded.data, tree.data)
+        self.assertRaises(ValueError, GrepTree.loads_binary,
+                          _HEADER.pack(MAGIC, 3) + body)
+
+    def test_keys(self):
+        """Keys should come out sorted and rebuild the same tree."""
+        tree = GrepTree()
+        tree.append('b.py', 3, 'x', ['def f'])
+        tree.append('a.py', 7, 'y', [])
+        tree.append('a.py', 2, 'z', [])
+        tree.append('a.py', 1, 'w', ['class C', 'def g'])
+
+        keys = list(tree.keys())
+        self.assertEqual(keys, [
+                (('a.py',), 2, 'z'),
+                (('a.py',), 7, 'y'),
+                (('a.py', 'class C', 'def g'), 1, 'w'),
+                (('b.py', 'def f'), 3, 'x'),
+                ])
+        self.assertEqual(keys, sorted(keys))
+
+        rebuilt = GrepTree.from_keys(keys)
+        self.assertEqual(list(rebuilt.keys()), keys)
+        self.assertEqual(rebuilt._count, 4)
+
+    def test_filter(self):
+        """Filtering should drop lines and any contexts left empty."""
+        tree = GrepTree()
+        tree.append('a.py', 1, 'keep', [])
+        tree.append('a.py', 2, 'drop', ['class C', 'def d'])
+        tree.append('a.py', 3, 'keep', ['class C'])
+        tree.append('b.py', 4, 'drop', ['def e'])
+
+        self.assertEqual(tree.filter(lambda text: text == 'keep'), 2)
+        self.assertEqual(tree.data, {'a.py': {
+                'lines': [(1, 'keep')],
+                'class C': {'lines': [(3, 'keep')]},
+                }})
+        self.assertEqual(tree.touch('a.py').count, 2)
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,79 @@
+import os
+import unittest
+
+from ..ignore import IgnoreRules, is_ignored, walk_files
+from .util import TempDirTestCase
+
+class TestIgnoreRules(unittest.TestCase):
+    def test_patterns(self):
+        rules = IgnoreRules('', [
+            '# comment',
+            '*.pyc',
+            'build/',
+            '/top.txt',
+            'docs/**/*.html',
+            ])
+
+        self.assertTrue(rules.match('a.pyc', False))
+        self.assertTrue(rules.match('lib/b.pyc', False))
+        self.assertTrue(rules.match('lib/build', True))
+        self.assertIsNone(rules.match('lib/build', False))
+        self.assertTrue(rules.match('top.txt', False))
+        self.assertIsNone(rules.match('lib/top.txt', False))
+        self.assertTrue(rules.match('docs/index.html', False))
+        self.assertTrue(rules.match('docs/a/b/index.html', False))
+        self.assertIsNone(rules.match('# comment', False))
+
+    def test_negate(self):
+        """The last matching rule should win."""
+        rules = IgnoreRules('', ['*.log', '!keep.log'])
+
+        self.assertTrue(rules.match('a.log', False))
+        self.assertFalse(rules.match('keep.log', False))
+
+    def test_nested(self):
+        """Rules from deeper ignore files should take precedence."""
+        rule_sets = [
+            IgnoreRules('', ['*.txt']),
+            IgnoreRules('sub', ['!a.txt']),
+            ]
+
+        self.assertTrue(is_ignored(rule_sets, 'b.txt', False))
+        self.assertTrue(is_ignored(rule_sets, 'sub/b.txt', False))
+        self.assertFalse(is_ignored(rule_sets, 'sub/a.txt', False))
+
+class TestWalkFiles(TempDirTestCase):
+    def setUp(self):
+        super(TestWalkFiles, self).setUp()
+        for path in ['a.py', 'b.pyc', 'build/c.py', 'sub/d.py', 'sub/e.py',
+                     '.git/f.py']:
+            self.write(path)
+
+        self.write('.ignore', "*.pyc\nbuild/\n")
+        self.write('sub/.gitignore', "e.py\n")
+
+    def test_walk(self):
+        paths = walk_files(
+                self.root,
+                os.path.join(self.root, '.ignore'),
+                '.gitignore',
+                ('.git',)
+                )
+        paths = [os.path.relpath(z, self.root) for z in paths]
+
+        self.assertEqual(paths, ['.ignore', 'a.py', 'sub/.gitignore',
+                                 'sub/d.py'])
+
+    def test_walk_skips_unreadable(self):
+        """Dangling symlinks and other things grep can't read are skipped."""
+        os.symlink('missing.py', os.path.join(self.root, 'dangling.py'))
+        os.mkfifo(os.path.join(self.root, 'fifo.py'))
+        paths = walk_files(self.root, always_skip=('.git',))
+        paths = [os.path.relpath(z, self.root) for z in paths]
+
+        self.assertNotIn('dangling.py', paths)
+        self.assertNotIn('fifo.py', paths)
+        self.assertIn('a.py', paths)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import unittest
+
+from ..index import TrigramIndex, required_trigrams
+from .util import TempDirTestCase
+
+class TestRequiredTrigrams(unittest.TestCase):
+    def test_literal(self):
+        self.assertEqual(required_trigrams('Enco.de'), set(['enc', 'nco']))
+
+    def test_optional(self):
+        """Characters that might not be there shouldn't be required."""
+        self.assertEqual(required_trigrams('abc?def'), set(['def']))
+        self.assertEqual(required_trigrams('x{2,3}yzw'), set(['yzw']))
+        self.assertEqual(required_trigrams('a\\{2,3\\}bcd'), set(['bcd']))
+        self.assertEqual(required_trigrams('foo\\?bar'), set(['bar']))
+        self.assertEqual(required_trigrams('abcd\\+efg'), set(['abc', 'efg']))
+        self.assertEqual(required_trigrams('[abc]defg'), set(['def', 'efg']))
+
+    def test_groups(self):
+        """Anything inside a group (in either syntax) is skipped."""
+        self.assertEqual(required_trigrams('foo(bar)baz'), set(['foo', 'baz']))
+        self.assertEqual(required_trigrams('foo\\(bar\\)'), set(['foo']))
+
+    def test_no_trigrams(self):
+        self.assertIsNone(required_trigrams('foo|bar'))
+        self.assertIsNone(required_trigrams('fo'))
+        self.assertIsNone(required_trigrams('\\w+'))
+
+    def test_numeric_escapes(self):
+        """The characters after these belong to the escape."""
+        self.assertIsNone(required_trigrams('\\x41bcd'))
+        self.assertIsNone(required_trigrams('\\u00e9abc'))
+        self.assertIsNone(required_trigrams('\\101bcd'))
+        self.assertIsNone(required_trigrams('(a)\\1bcd'))
+
+    def test_inline_flags(self):
+        self.assertIsNone(required_trigrams('(?x)foo bar'))
+        self.assertIsNone(required_trigrams('(?i)foobar'))
+        self.assertIsNone(required_trigrams('abc(?s)de.f'))
+
+class TestTrigramIndex(TempDirTestCase):
+    def setUp(self):
+        super(TestTrigramIndex, self).setUp()
+        self.paths = []
+        for name, text in [('a.py', 'def foo'), ('b.py', 'def bar'),
+                           ('c.py', 'foo\x00')]:
+            path = os.path.join(self.root, name)
+            self.write(path, text, 0)
+            self.paths.append(path)
+
+    def test_narrow(self):
+        index = TrigramIndex('*.py', self.root)
+        self.assertEqual(index.update(self.paths), 3)
+        index.save()
+
+        index = TrigramIndex('*.py', self.root)
+        self.assertTrue(index.loaded)
+        narrow = lambda z: list(index.narrow(self.paths, required_trigrams(z)))
+        self.assertEqual(narrow('foo'), self.paths[:1])
+        self.assertEqual(narrow('def'), self.paths[:2])
+        self.assertEqual(narrow('baz'), [])
+        self.assertEqual(narrow('a|b'), self.paths)
+
+    def test_changed(self):
+        """Files that changed since they were indexed are always searched."""
+        index = TrigramIndex('*.py', self.root)
+        index.update(self.paths)
+
+        with open(self.paths[1], 'a') as outp:
+            outp.write('\nfoo')
+        os.utime(self.paths[1], (1, 1))
+        self.assertEqual(
+                list(index.narrow(self.paths, set(['foo']))),
+                self.paths[:2]
+                )
+
+        # Only the changed file is read again
+        self.assertEqual(index.update(self.paths), 1)
+        self.assertEqual(
+                list(index.narrow(self.paths, set(['foo']))),
+                self.paths[:2]
+                )
+
+if __name__ == "__main__":
+    unittest.main()
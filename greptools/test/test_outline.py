@@ -0,0 +1,114 @@
+import os
+import unittest
+
+from ..cache import OutlineCache, ResultCache, tree_fingerprint
+from ..greptree import GrepTree
+from ..outline import Outline, ScopeStack
+from .util import TempDirTestCase
+
+class TestOutline(unittest.TestCase):
+    def setUp(self):
+        """Outline for a class containing two methods, then a function."""
+        self.outline = Outline([
+            (2, 10, -1, 'class A'),
+            (3, 5, 0, 'def b'),
+            (7, 10, 0, 'def c'),
+            (12, 15, -1, 'def d'),
+            ])
+
+    def test_contexts(self):
+        self.assertEqual(self.outline.contexts(1), [])
+        self.assertEqual(self.outline.contexts(2), ['class A'])
+        self.assertEqual(self.outline.contexts(4), ['class A', 'def b'])
+        self.assertEqual(self.outline.contexts(6), ['class A'])
+        self.assertEqual(self.outline.contexts(10), ['class A', 'def c'])
+        self.assertEqual(self.outline.contexts(11), [])
+        self.assertEqual(self.outline.contexts(15), ['def d'])
+        self.assertEqual(self.outline.contexts(16), [])
+
+    def test_scope_stack(self):
+        """Unnamed scopes shouldn't show up but should still nest."""
+        scopes = ScopeStack()
+        scopes.line_number = 1
+        scopes.open(0, 'class A')
+        scopes.line_number = 2
+        scopes.open(4)
+        scopes.line_number = 3
+        scopes.open(8, 'def b')
+        scopes.line_number = 5
+        scopes.close(0)
+        outline = scopes.finish()
+
+        self.assertEqual(outline.scopes, [(2, 4, -1, 'class A'),
+                                          (4, 4, 0, 'def b')])
+        self.assertEqual(outline.contexts(4), ['class A', 'def b'])
+
+class TestOutlineCache(TempDirTestCase):
+    def setUp(self):
+        super(TestOutlineCache, self).setUp()
+        self.file_name = 'a.py'
+        self.write(self.file_name, "def a():\n    pass\n", 0)
+
+    def test_round_trip(self):
+        cache = OutlineCache('Python', self.root)
+        outline = Outline([(2, 2, -1, 'def a')])
+        stat = os.stat(self.file_name)
+
+        self.assertIsNone(cache.get(self.file_name, stat))
+        cache.put(self.file_name, stat, outline)
+        self.assertEqual(cache.get(self.file_name, stat).scopes,
+                         outline.scopes)
+
+    def test_stale(self):
+        """Changing a file's size or mtime should invalidate it's entry."""
+        cache = OutlineCache('Python', self.root)
+        cache.put(
+                self.file_name,
+                os.stat(self.file_name),
+                Outline([(2, 2, -1, 'def a')])
+                )
+
+        os.utime(self.file_name, (1, 1))
+        self.assertIsNone(cache.get(self.file_name, os.stat(self.file_name)))
+
+class TestResultCache(TempDirTestCase):
+    def tree(self, size):
+        tree = GrepTree()
+        tree.append('./a.py', 1, 'x' * size, ['def a'])
+        return tree
+
+    def test_round_trip(self):
+        cache = ResultCache(self.root)
+        self.assertIsNone(cache.get('a'))
+
+        cache.put('a', self.tree(10))
+        self.assertEqual(cache.get('a').data, self.tree(10).data)
+
+    def test_evict(self):
+        """The least recently used entries should be evicted first."""
+        cache = ResultCache(self.root, 2500)
+        cache.put('a', self.tree(1000))
+        cache.put('b', self.tree(1000))
+        for name in os.listdir(cache.path):
+            os.utime(os.path.join(cache.path, name), (0, 0))
+
+        cache.get('a')
+        cache.put('c', self.tree(1000))
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_tree_fingerprint(self):
+        path = os.path.join(self.root, 'a.py')
+        self.write(path, "pass\n")
+
+        self.assertIsNone(tree_fingerprint([path]))
+
+        os.utime(path, (0, 0))
+        before = tree_fingerprint([path])
+        os.utime(path, (1, 1))
+        self.assertNotEqual(before, tree_fingerprint([path]))
+
+if __name__ == "__main__":
+    unittest.main()
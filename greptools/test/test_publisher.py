@@ -0,0 +1,66 @@
+import sys
+import unittest
+
+from ..greptree import GrepTree
+from ..publisher import CleanPublisher, FilePublisher
+from ..reader import PythonReader
+from .util import FakeOutput, TempDirTestCase, make_config
+
+class TestPublisher(unittest.TestCase):
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = self.outp = FakeOutput(True)
+
+        self.tree = GrepTree()
+        self.tree.append('a.py', 1, 'import os', [])
+        self.tree.append('a.py', 5, '    os.sep', ['def b'])
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_publish_file(self):
+        """Each file should be written in one go."""
+        pub = CleanPublisher(make_config())
+        pub.publish_file('a.py', self.tree.touch('a.py'))
+
+        self.assertEqual(self.outp.chunks, [
+                "a.py\n"
+                "     1:^import os$\n"
+                "\n"
+                "    def b\n"
+                "         5:^    os.sep$\n"
+                "\n"
+                ])
+        self.assertEqual(pub.count, 2)
+
+    def test_truncated(self):
+        self.tree.truncated = True
+        CleanPublisher(make_config()).publish(self.tree)
+        self.assertTrue(self.outp.getvalue().endswith(
+                "Stopped at a limit after 2 matches in 1 files, "
+                "there may be more.\n"
+                ))
+
+    def test_files(self):
+        FilePublisher(make_config(debug=True)).publish(self.tree)
+        self.assertEqual(self.outp.getvalue(), "a.py\nTotal found: 2\n")
+
+class TestStreaming(TempDirTestCase):
+    def setUp(self):
+        super(TestStreaming, self).setUp()
+        for name in ['a.py', 'b.py']:
+            self.write(name, "def f():\n    foo()\n")
+
+    def test_from_grep(self):
+        """Files should be streamed as they're resolved and then dropped."""
+        config = make_config(search_term='foo')
+        streamed = {}
+        def stream(file_path, node):
+            streamed[file_path] = node.count
+
+        reader = PythonReader.from_grep(config, stream)
+        self.assertEqual(streamed, {'./a.py': 1, './b.py': 1})
+        self.assertEqual(reader.tree._count, 0)
+
+if __name__ == "__main__":
+    unittest.main()
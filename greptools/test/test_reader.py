@@ -1,9 +1,18 @@
 import unittest
 
+from StringIO import StringIO
+
+import mock
 from mock import Mock
 from tempfile import NamedTemporaryFile as TF
 
-from ..reader.reader import BraceReader, replace_parens
+from ..greptree import GrepTree
+from ..reader.reader import (Background, BraceReader, SET_OPS, merge_keys,
+                             replace_parens, set_op)
+from ..reader.pythonreader import PythonReader
+from ..reader.javareader import JavaReader
+from ..searcher import Searcher, walk_files
+from .util import TempDirTestCase, make_config
 
 class TestReaderHelperMethods(unittest.TestCase):
     def test_replace_parens_succeed(self):
@@ -69,29 +78,7 @@ class TestReaderHelperMethods(unittest.TestCase):
 class TestBraceReader(unittest.TestCase):
     def setUp(self):
         """Sets up a BraceReader object for use in the tests."""
-        config = Mock()
-        config.debug = False
-        self.br = BraceReader(config)
-
-    def test_recursive_rfind_simple(self):
-        """As simple a test as possilble."""
-        example = "This is(a test)"
-        expected = 7
-        result = self.br.recursive_rfind(example, '(', ')', 10)
-        self.assertEqual(result, expected)
-
-    def test_recursive_rfind_fake_code(self):
-        """A test against some psudo-code."""
-        example = """class Test {
-    func test() {
-        this will be skipped;
-        }
-    Blah blah blah
-    }
-"""
-        expected = 11
-        result = self.br.recursive_rfind(example, '{', '}', 76)
-        self.assertEqual(result, expected)
+        self.br = BraceReader(make_config())
 
     def test_get_context(self):
         text = """class A(blah) {
@@ -106,6 +93,317 @@ class TestBraceReader(unittest.TestCase):
 
         print self.br.get_context(file_name, 3)
 
+class TestJavaReader(unittest.TestCase):
+    def setUp(self):
+        """Sets up a JavaReader object for use in the tests."""
+        self.jr = JavaReader(make_config())
+
+    def test_build_outline_skips_literals(self):
+        """Braces in comments and literals shouldn't open or close blocks."""
+        text = """public class A {
+    // closing brace }
+    private String s = "}";
+    private char c = '{';
+    /* another {
+       one } */
+    public void b(int x) {
+        sample text;
+    }
+}
+"""
+        outline = self.jr.build_outline(text.splitlines(True))
+
+        self.assertEqual(outline.contexts(3), ['public class A'])
+        self.assertEqual(outline.contexts(8), ['public class A',
+                                               'public void b(...)'])
+        self.assertEqual(outline.contexts(10), ['public class A'])
+        self.assertEqual(outline.contexts(11), [])
+
+    def test_build_outline_deep_nesting(self):
+        """Deeply nested blocks shouldn't hit the recursion limit."""
+        depth = 5000
+        lines = ['{\n'] * depth + ['sample text;\n'] + ['}\n'] * depth
+        outline = self.jr.build_outline(lines)
+
+        self.assertEqual(outline.contexts(depth + 1), [])
+
+class TestPythonReader(unittest.TestCase):
+    def setUp(self):
+        """Sets up a PythonReader object for use in the tests."""
+        self.pr = PythonReader(make_config())
+
+    def test_resolve_file(self):
+        """Several hits in one file should each get their own context."""
+        text = """import os
+
+class A(object):
+    def b(self):
+        if True:
+            return os.sep
+
+    def c(self):
+        return os.sep
+
+def d():
+    return os.sep
+"""
+        with TF(delete=False) as outp:
+            outp.write(text)
+            file_name = outp.name
+
+        tree = GrepTree({})
+        self.pr.resolve_file(file_name, [1, 6, 9, 12], tree)
+
+        expected = {file_name: {
+            'lines': [(1, 'import os')],
+            'class A': {
+                'def b': {'lines': [(6, '            return os.sep')]},
+                'def c': {'lines': [(9, '        return os.sep')]},
+                },
+            'def d': {'lines': [(12, '    return os.sep')]},
+            }}
+        self.assertEqual(tree.data, expected)
+        self.assertEqual(tree._count, 4)
+
+    def test_build_outline_tabs(self):
+        """Tabs count as four spaces of indentation."""
+        lines = [
+            "class A:\n",
+            "\tdef b(self):\n",
+            "        pass\n",
+            "    \n",
+            "\tx = 1\n",
+            ]
+        outline = self.pr.build_outline(lines)
+
+        self.assertEqual(outline.contexts(3), ['class A', 'def b'])
+        self.assertEqual(outline.contexts(5), ['class A'])
+
+    def test_build_outline_exact(self):
+        """The tokenize based outline should cope with decorators, async
+        functions and strings that look like code."""
+        lines = [
+            "@decorator\n",
+            "async def a():\n",
+            "    s = \"\"\"\n",
+            "def not_a_function():\n",
+            "\"\"\"\n",
+            "    return s\n",
+            "# comment\n",
+            "class B: pass\n",
+            ]
+        self.pr.exact = True
+        outline = self.pr.build_outline(lines)
+
+        self.assertEqual(outline.contexts(1), [])
+        self.assertEqual(outline.contexts(4), ['def a'])
+        self.assertEqual(outline.contexts(6), ['def a'])
+        self.assertEqual(outline.contexts(8), [])
+
+    def test_build_outline_exact_fallback(self):
+        """Files that can't be tokenized fall back on indentation."""
+        lines = [
+            "def a():\n",
+            "    x = (\n",
+            ]
+        self.pr.exact = True
+        outline = self.pr.build_outline(lines)
+
+        self.assertEqual(outline.contexts(2), ['def a'])
+
+    def test_add_to_tree_parallel(self):
+        """Using a pool of processes shouldn't change the results."""
+        file_names = []
+        for i in range(5):
+            with TF(delete=False) as outp:
+                outp.write("def f%d():\n    pass\n    pass\n" % i)
+                file_names.append(outp.name)
+        results = ['%s:%d:    pass' % (name, line)
+                   for name in file_names for line in (2, 3)]
+
+        serial = GrepTree({})
+        reader = PythonReader(make_config())
+        reader.add_to_tree(results, serial)
+
+        parallel = GrepTree({})
+        reader = PythonReader(make_config(jobs=2))
+        reader.add_to_tree(results, parallel)
+
+        self.assertEqual(serial.data, parallel.data)
+        self.assertEqual(serial._count, parallel._count)
+
+class TestFastFilters(unittest.TestCase):
+    def reader(self, search_term, patterns=None, case_off=False):
+        reader = PythonReader(make_config(search_term=search_term,
+                                          patterns=patterns,
+                                          case_off=case_off))
+        reader.tree.append('a.py', 1, 'foo bar', ['def f'])
+        reader.tree.append('a.py', 2, 'foo', ['def f'])
+        reader.tree.append('b.py', 3, 'Bar', [])
+        return reader
+
+    def test_fast_inter(self):
+        reader = self.reader('foo', ['bar'])
+        reader.fast_inter()
+        self.assertEqual(reader.tree.data,
+                         {'a.py': {'def f': {'lines': [(1, 'foo bar')]}}})
+
+    def test_fast_inter_case_off(self):
+        reader = self.reader('bar', case_off=True)
+        reader.fast_inter()
+        self.assertEqual(reader.tree._count, 2)
+
+    def test_fast_exclude(self):
+        reader = self.reader('bar', ['^foo$'])
+        reader.fast_exclude()
+        self.assertEqual(reader.tree.data, {'b.py': {'lines': [(3, 'Bar')]}})
+
+    def test_fast_exclude_groups(self):
+        """Backreferences should still refer to their own pattern's group."""
+        reader = self.reader('(a)\\1', ['(b)\\1'])
+        reader.tree.append('c.py', 4, 'bb', [])
+        reader.tree.append('c.py', 5, 'ab', [])
+        reader.fast_exclude()
+        self.assertEqual(reader.tree.touch('c.py').lines(), [(5, 'ab')])
+
+class TestBackground(unittest.TestCase):
+    def test_result(self):
+        self.assertEqual(Background(sum, [1, 2]).get(), 3)
+
+    def test_exit(self):
+        """Exiting in the background should exit when the result is used."""
+        def search():
+            raise SystemExit()
+
+        background = Background(search)
+        self.assertRaises(SystemExit, background.get)
+
+class TestSetOps(unittest.TestCase):
+    def setUp(self):
+        self.a = GrepTree()
+        self.a.append('a.py', 1, 'one', ['def f'])
+        self.a.append('a.py', 2, 'two', ['def f'])
+        self.a.append('b.py', 1, 'one', [])
+
+        self.b = GrepTree()
+        self.b.append('a.py', 2, 'two', ['def f'])
+        self.b.append('a.py', 2, 'two', ['def f'])
+        self.b.append('c.py', 5, 'five', ['class C'])
+
+    def lines(self, op):
+        tree, count = set_op(self.a, self.b, SET_OPS[op])
+        self.assertEqual(count, tree._count)
+        return list(tree.keys())
+
+    def test_json_tree(self):
+        """Non-ASCII contexts from json should merge with searched ones."""
+        self.a.append('a.py', 3, 'three', ['def caf\xc3\xa9_x'])
+        outp = StringIO()
+        self.a.dump(outp)
+        self.a = GrepTree.load(StringIO(outp.getvalue()))
+        self.b.append('a.py', 4, 'four', ['def caf\xc3\xa9_x'])
+
+        self.assertEqual(len(self.lines('union')), 6)
+
+    def test_merge_keys(self):
+        self.assertEqual(
+                list(merge_keys([1, 2, 2, 4], [2, 3, 3])),
+                [(1, True, False), (2, True, True), (3, False, True),
+                 (4, True, False)]
+                )
+
+    def test_union(self):
+        self.assertEqual(self.lines('union'), [
+                (('a.py', 'def f'), 1, 'one'),
+                (('a.py', 'def f'), 2, 'two'),
+                (('b.py',), 1, 'one'),
+                (('c.py', 'class C'), 5, 'five'),
+                ])
+
+    def test_diff(self):
+        self.assertEqual(self.lines('diff'), [
+                (('a.py', 'def f'), 1, 'one'),
+                (('b.py',), 1, 'one'),
+                (('c.py', 'class C'), 5, 'five'),
+                ])
+
+    def test_exclude(self):
+        self.assertEqual(self.lines('exclude'), [
+                (('a.py', 'def f'), 1, 'one'),
+                (('b.py',), 1, 'one'),
+                ])
+
+    def test_inter(self):
+        self.assertEqual(self.lines('inter'), [
+                (('a.py', 'def f'), 2, 'two'),
+                ])
+
+class TestPipedSetOps(TempDirTestCase):
+    def setUp(self):
+        super(TestPipedSetOps, self).setUp()
+        for name in ['a.py', 'b.py']:
+            self.write(name, "def f():\n    foo()\n    bar()\n")
+
+    def reader(self):
+        reader = PythonReader(make_config(search_term='bar'))
+        reader.tree.append('./a.py', 2, '    foo()', ['def f'])
+        reader.tree.append('./gone.py', 1, 'foo()', [])
+        return reader
+
+    def test_inter(self):
+        """Only files in the piped tree that still exist are searched."""
+        reader = self.reader()
+        search = Mock(wraps=Searcher.search)
+        with mock.patch.object(Searcher, 'search', lambda *a: search(*a)):
+            reader.inter()
+
+        self.assertEqual(search.call_args[0][2], ['./a.py'])
+        self.assertEqual(reader.tree._count, 0)
+
+    def test_union_in_background(self):
+        """Searching while the piped tree is read should give the same
+        results as searching afterwards."""
+        reader = self.reader()
+        reader.union(PythonReader.search_in_background(reader.config).get())
+        background = reader.tree.data
+
+        reader = self.reader()
+        reader.union()
+        self.assertEqual(reader.tree.data, background)
+        self.assertEqual(reader.tree._count, 4)
+
+    def test_exclude(self):
+        reader = self.reader()
+        reader.exclude()
+        self.assertEqual(reader.tree.data, {
+                './a.py': {'def f': {'lines': [(2, '    foo()')]}},
+                './gone.py': {'lines': [(1, 'foo()')]},
+                })
+
+class TestCachedSearch(TempDirTestCase):
+    def setUp(self):
+        super(TestCachedSearch, self).setUp()
+        for name in ['a.py', 'b.py']:
+            self.write(name, "def f():\n    foo()\n", mtime=0)
+
+    def build_tree(self, query):
+        reader = PythonReader(make_config(cache=True, search_term=query))
+        walk = Mock(wraps=walk_files)
+        with mock.patch('greptools.searcher.walk_files', walk):
+            tree = reader.build_tree(query)
+
+        self.assertEqual(walk.call_count, 1)
+        return tree
+
+    def test_walk_once(self):
+        """The files found for the cache key should be the ones searched."""
+        self.assertEqual(self.build_tree('foo')._count, 2)
+        self.assertEqual(self.build_tree('foo')._count, 2)
+
+    def test_nothing_found(self):
+        with mock.patch('sys.stdout', StringIO()) as stdout:
+            self.assertRaises(SystemExit, self.build_tree, 'bar')
+        self.assertIn("Couldn't find anything", stdout.getvalue())
 
 if __name__ == "__main__":
     unittest.main()
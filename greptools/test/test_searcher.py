@@ -0,0 +1,224 @@
+import os
+import re
+import subprocess
+import time
+import unittest
+
+import mock
+from tempfile import NamedTemporaryFile as TF
+
+from ..base import GrepTools
+from ..searcher import Searcher, group_rows
+from .util import TempDirTestCase, make_config
+
+class TestGroupRows(unittest.TestCase):
+    def test_group_rows(self):
+        rows = ['a.py:1:x', 'a.py:3:y:z', 'b.py:2:w']
+
+        self.assertEqual(list(group_rows(rows)), [
+            ('a.py', (1, 3), ('x', 'y:z'), None),
+            ('b.py', (2,), ('w',), None),
+            ])
+
+class TestSearchFile(unittest.TestCase):
+    def setUp(self):
+        with TF(delete=False) as outp:
+            outp.write("def a():\n    foo = 1\n\nfoo\nbar foo foo")
+            self.file_name = outp.name
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def test_search_file(self):
+        """Every line with a hit should be found once, along with all of the
+        lines in the file."""
+        regex = re.compile('foo', re.MULTILINE)
+        file_lines, line_texts, lines = Searcher.search_file(
+                regex,
+                self.file_name
+                )
+
+        self.assertEqual(file_lines, [2, 4, 5])
+        self.assertEqual(line_texts, ['    foo = 1', 'foo', 'bar foo foo'])
+        self.assertEqual(len(lines), 5)
+
+    def test_search_file_per_line(self):
+        """Matches shouldn't span more than one line, like in grep."""
+        regex = re.compile(r'1\s*foo|^$', re.MULTILINE)
+        file_lines, _, _ = Searcher.search_file(regex, self.file_name)
+
+        self.assertEqual(file_lines, [3])
+
+    def test_search_file_max_count(self):
+        regex = re.compile('foo', re.MULTILINE)
+        file_lines, _, _ = Searcher.search_file(regex, self.file_name, 2)
+
+        self.assertEqual(file_lines, [2, 4])
+
+    def test_search_file_no_match(self):
+        regex = re.compile('baz', re.MULTILINE)
+
+        self.assertIsNone(Searcher.search_file(regex, self.file_name))
+
+    def test_search_file_binary(self):
+        with open(self.file_name, 'ab') as outp:
+            outp.write('\x00')
+        regex = re.compile('foo', re.MULTILINE)
+
+        self.assertIsNone(Searcher.search_file(regex, self.file_name))
+
+class TestLimit(unittest.TestCase):
+    def limit(self, **limits):
+        searcher = Searcher(make_config(**limits))
+        self.closed = False
+
+        def groups():
+            try:
+                for name in 'abc':
+                    yield name, (1, 2, 3), ('x', 'y', 'z'), None
+            finally:
+                self.closed = True
+
+        return list(searcher.limit(groups())), searcher.truncated
+
+    def test_no_limit(self):
+        groups, truncated = self.limit()
+        self.assertEqual(len(groups), 3)
+        self.assertFalse(truncated)
+
+    def test_max_count(self):
+        """The search should be stopped as soon as the limit is reached."""
+        groups, truncated = self.limit(max_count=4)
+        self.assertEqual(groups, [
+                ('a', (1, 2, 3), ('x', 'y', 'z'), None),
+                ('b', (1,), ('x',), None),
+                ])
+        self.assertTrue(truncated)
+        self.assertTrue(self.closed)
+
+    def test_max_files(self):
+        groups, truncated = self.limit(max_files=2)
+        self.assertEqual([z[0] for z in groups], ['a', 'b'])
+        self.assertTrue(truncated)
+
+    def test_max_per_file(self):
+        groups, truncated = self.limit(max_per_file=2)
+        self.assertEqual([z[1] for z in groups], [(1, 2)] * 3)
+        self.assertTrue(truncated)
+
+    def test_grep_max_count(self):
+        config = make_config(max_per_file=2)
+        self.assertIn('--max-count=2', Searcher(config)._grep_cmd('foo'))
+
+class TestShards(TempDirTestCase):
+    def setUp(self):
+        super(TestShards, self).setUp()
+        for i, size in enumerate([50, 10, 10, 10, 10, 10, 40, 20]):
+            self.write('f%d.py' % i, "foo\n" * size)
+
+    def test_shard_files(self):
+        """Shards should be balanced by size and keep the order of paths."""
+        paths = ['./f%d.py' % z for z in range(8)]
+        shards = Searcher.shard_files(paths, 3)
+
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(sorted(sum(shards, [])), paths)
+        totals = []
+        for shard in shards:
+            self.assertEqual(shard, sorted(shard))
+            totals.append(sum(os.path.getsize(z) for z in shard))
+        self.assertLessEqual(max(totals) - min(totals), 4 * 10)
+
+    def test_grep_sharded(self):
+        """Sharding should find the same rows in the same order."""
+        def search(jobs):
+            config = make_config(jobs=jobs, no_ignore=True)
+            return list(Searcher(config, ['*.py']).grep_for('foo'))
+
+        serial = search(1)
+        for jobs in [2, 3, 8]:
+            self.assertEqual(search(jobs), serial)
+
+    def test_grep_sharded_stop(self):
+        """Greps should be killed as soon as their rows stop being read."""
+        for i in range(30):
+            self.write('g%02d.py' % i, "foo\n" * 2000)
+        procs = []
+        popen = subprocess.Popen
+        def record(*args, **kwargs):
+            procs.append(popen(*args, **kwargs))
+            return procs[-1]
+
+        searcher = Searcher(make_config(jobs=3, no_ignore=True), ['g*.py'])
+        searcher.READ_AHEAD = 1
+        with mock.patch('subprocess.Popen', record):
+            rows = searcher.grep_for('foo')
+            next(rows)
+            # The rest of their output isn't read ahead of time
+            time.sleep(1.5)
+            self.assertTrue(any(z.poll() is None for z in procs))
+            rows.close()
+
+        began = time.time()
+        while any(z.poll() is None for z in procs) and time.time() - began < 5:
+            time.sleep(0.01)
+        self.assertEqual(len(procs), 3)
+        self.assertEqual([z.poll() for z in procs if z.poll() is None], [])
+
+    def test_negative_jobs(self):
+        parser = GrepTools.arg_parser('Python')
+        with mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit, parser.parse_args, ['-j', '-1'])
+        self.assertEqual(parser.parse_args(['-j', '0']).jobs, 0)
+
+    def test_grep_missing_file(self):
+        """A file grep can't read shouldn't lose the hits in the others."""
+        config = make_config(no_ignore=True)
+        rows = Searcher(config).grep_for('foo', ['./f0.py', './gone.py'])
+
+        self.assertEqual(len(list(rows)), 50)
+
+class TestGitBackend(TempDirTestCase):
+    def setUp(self):
+        super(TestGitBackend, self).setUp()
+        subprocess.check_call(['git', 'init', '-q', '.'])
+        for path in ['a.py', 'ignored.py', 'sub/b.py', 'sub/c.txt']:
+            self.write(path, "foo\n")
+        self.write('.gitignore', "ignored.py\n")
+
+    def search(self, **kwargs):
+        config = make_config(backend='git', **kwargs)
+        return list(Searcher(config, ['*.py']).search('foo'))
+
+    def test_git_grep(self):
+        """Untracked files should be searched unless they're ignored."""
+        self.assertEqual(self.search(), [
+            ('./a.py', (1,), ('foo',), None),
+            ('./sub/b.py', (1,), ('foo',), None),
+            ])
+
+    def test_git_grep_no_ignore(self):
+        self.assertEqual(len(self.search(no_ignore=True)), 3)
+
+    def test_git_grep_tracked_ignored(self):
+        """Tracked files are searched even if they match an ignore rule."""
+        self.write('tracked.py', "foo\n")
+        subprocess.check_call(['git', 'add', 'tracked.py'])
+        subprocess.check_call([
+            'git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com',
+            'commit', '-q', '-m', 'Tracked',
+            ])
+        self.write('.gitignore', "ignored.py\ntracked.py\n")
+        self.assertEqual(self.search(), [
+            ('./tracked.py', (1,), ('foo',), None),
+            ('./a.py', (1,), ('foo',), None),
+            ('./sub/b.py', (1,), ('foo',), None),
+            ])
+
+    def test_git_grep_subdir(self):
+        """Paths should be relative to the current directory."""
+        os.chdir('sub')
+        self.assertEqual(self.search(), [('./b.py', (1,), ('foo',), None)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import sys
+import unittest
+
+import mock
+from threading import Thread
+
+from ..base import GrepTools
+from ..cache import OutlineCache
+from ..client import search_remote
+from ..reader import PythonReader
+from ..server import GrepServer, SearchHandler
+from .util import FakeInput, FakeOutput, TempDirTestCase
+
+class TestServer(TempDirTestCase):
+    def setUp(self):
+        super(TestServer, self).setUp()
+        self.write('a.py', "class A(object):\n    def foo(self):\n        pass\n")
+
+        self.server = GrepServer(os.path.join(self.root, 'test.sock'))
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        OutlineCache._memory = None
+        super(TestServer, self).tearDown()
+
+    def search(self, argv, stdin, remote):
+        """Run pygt, returns what it wrote to stdout."""
+        stdin = FakeInput(stdin, stdin is None)
+        stdout = FakeOutput(False)
+        if remote:
+            self.assertEqual(search_remote(
+                    'PythonReader',
+                    argv,
+                    self.server.path,
+                    stdin,
+                    stdout
+                    ), 0)
+        else:
+            # Publishers print to sys.stdout
+            real_stdout = sys.stdout
+            sys.stdout = stdout
+            try:
+                GrepTools(PythonReader, argv, stdin, stdout)
+            except SystemExit:
+                pass
+            finally:
+                sys.stdout = real_stdout
+
+        return stdout.getvalue()
+
+    def test_same_output(self):
+        """The server should give the same output as a greptool would,
+        including when results are piped in."""
+        for remote in (False, True):
+            piped = self.search(['pygt', 'pass'], None, remote)
+            self.assertTrue(piped)
+            self.assertEqual(
+                    self.search(['pygt', '-p', '-f', 'clean', 'foo'], None, remote),
+                    "./a.py\n    class A\n         2:^    def foo(self):$\n\n"
+                    )
+            self.assertEqual(
+                    self.search(['pygt', '-U', '-p', '-f', 'files', 'foo'], piped, remote),
+                    "./a.py\n"
+                    )
+
+    def test_streamed_output(self):
+        """Output should be passed on while the search is still running."""
+        running = []
+        stdout = FakeOutput(True)
+        stdout.flush = lambda: running.append(SearchHandler.lock.locked())
+
+        search_remote('PythonReader', ['pygt', '-f', 'clean', 'foo'],
+                      self.server.path, FakeInput(None, True), stdout)
+        self.assertIn("def foo", stdout.getvalue())
+        self.assertTrue(running[0])
+
+    def test_piped_between_clients(self):
+        """`pygt pass | pygt -U foo` with both run by the server. The second one
+        connects first and has to wait for what the first sends it, which is
+        more than fits in a socket's buffers."""
+        for indx in range(300):
+            self.write('p%03d.py' % indx, "def bar():\n    pass\n" * 50)
+
+        read_fd, write_fd = os.pipe()
+        stdout = FakeOutput(False)
+        second = Thread(target=search_remote, args=(
+                'PythonReader', ['pygt', '-U', '-p', '-f', 'files', 'foo'],
+                self.server.path, os.fdopen(read_fd, 'rb'), stdout
+                ))
+        second.start()
+
+        with os.fdopen(write_fd, 'wb') as piped:
+            self.assertEqual(search_remote(
+                    'PythonReader', ['pygt', 'pass'], self.server.path,
+                    FakeInput(None, True), piped
+                    ), 0)
+        second.join()
+        found = stdout.getvalue().splitlines()
+        self.assertEqual(len(found), 301)
+        self.assertIn('./a.py', found)
+
+    def test_errors(self):
+        """Errors and the exit status should be passed back to the client."""
+        stdout = FakeOutput(False)
+        stderr = FakeOutput(False)
+        status = search_remote('PythonReader', ['pygt', '-b', 'bogus', 'foo'],
+                               self.server.path, FakeInput(None, True),
+                               stdout, stderr)
+
+        self.assertEqual(status, 2)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertTrue(stderr.getvalue().startswith("usage: pygt "))
+        self.assertIn("invalid choice: 'bogus'", stderr.getvalue())
+
+        stderr = FakeOutput(False)
+        search_remote('PythonReader', ['pygt', '-p', 'foo\\('],
+                      self.server.path, FakeInput(None, True), stdout, stderr)
+        self.assertIn("grep: ", stderr.getvalue())
+
+    def test_unknown_reader(self):
+        """A reader the server doesn't have should be run locally, so stdin
+        mustn't be used up."""
+        stdin = FakeInput('piped', False)
+        self.assertIsNone(search_remote('XReader', ['xgt', 'foo'],
+                                        self.server.path, stdin))
+        self.assertEqual(stdin.read(), 'piped')
+
+    def test_not_our_socket(self):
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertIsNone(search_remote(
+                    'PythonReader',
+                    ['pygt', 'foo'],
+                    self.server.path
+                    ))
+
+    def test_no_server(self):
+        self.assertIsNone(search_remote(
+                'PythonReader',
+                ['pygt', 'foo'],
+                os.path.join(self.root, 'missing.sock')
+                ))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import unittest
+
+from ..reader import PythonReader
+from .util import TempDirTestCase, make_config
+
+class TestRefresh(TempDirTestCase):
+    def setUp(self):
+        super(TestRefresh, self).setUp()
+        for name in ['a.py', 'b.py', 'c.py']:
+            self.write(name, "def %s():\n    foo()\n" % name[0], 0)
+
+        self.snapshot = os.path.join(self.root, 'snapshot.json')
+        self.config = make_config()
+
+    def refresh(self):
+        return PythonReader(self.config).refresh(self.snapshot, 'foo')
+
+    def search(self):
+        return PythonReader(self.config).build_tree('foo')
+
+    def test_refresh(self):
+        """Refreshed trees should match a new search."""
+        self.assertEqual(self.refresh().data, self.search().data)
+
+        self.write('a.py', "def a():\n    pass\n", 1)
+        self.write('b.py', "def b():\n    foo()\n    foo()\n", 1)
+        os.remove('c.py')
+        self.write('d.py', "foo()\n", 1)
+
+        tree = self.refresh()
+        self.assertEqual(tree.data, self.search().data)
+        self.assertEqual(tree._count, 3)
+
+    def test_refresh_unchanged(self):
+        """Files that haven't changed shouldn't be searched again."""
+        self.refresh()
+
+        # Same size and mtime, so it looks unchanged
+        self.write('a.py', "def a():\n    bar()\n", 0)
+        self.assertIn('./a.py', self.refresh().data)
+
+    def test_refresh_other_query(self):
+        """Snapshots of a different query are replaced."""
+        PythonReader(self.config).refresh(self.snapshot, 'def')
+        self.assertEqual(self.refresh().data, self.search().data)
+
+    def commit(self):
+        subprocess.check_call(['git', 'add', '.'])
+        subprocess.check_call(['git', '-c', 'user.name=test',
+                               '-c', 'user.email=test@example.com',
+                               'commit', '-q', '-m', 'test'])
+
+    def test_refresh_since(self):
+        """Only files git says have changed should be searched again."""
+        subprocess.check_call(['git', 'init', '-q', '.'])
+        self.commit()
+        self.refresh()
+
+        self.write('c.py', "def c():\n    pass\n", 1)
+        self.commit()
+        self.write('a.py', "def a():\n    pass\n", 1)
+        self.config.since = 'HEAD'
+        data = self.refresh().data
+
+        self.assertEqual(sorted(data), ['./b.py', './c.py'])
+
+if __name__ == "__main__":
+    unittest.main()
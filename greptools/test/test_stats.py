@@ -0,0 +1,81 @@
+import json
+import unittest
+
+from cStringIO import StringIO
+from threading import Thread
+
+from .. import stats
+
+class TestStats(unittest.TestCase):
+    def tearDown(self):
+        stats.stop()
+
+    def test_off(self):
+        """Nothing should be collected unless it's been started."""
+        with stats.stage('a'):
+            stats.count('b')
+        self.assertEqual(list(stats.timed('c', [1, 2])), [1, 2])
+        self.assertIsNone(stats.stop())
+
+    def test_collect(self):
+        stats.start()
+        with stats.stage('outer'):
+            with stats.stage('inner'):
+                stats.count('files', 2)
+            with stats.stage('inner'):
+                stats.count('files')
+        self.assertEqual(list(stats.timed('iter', 'ab')), ['a', 'b'])
+        collected = stats.stop()
+
+        self.assertEqual(collected.order, ['inner', 'outer', 'iter'])
+        self.assertEqual(collected.stages['inner'][0], 2)
+        self.assertEqual(collected.stages['outer'][0], 1)
+        # Once for each item and once more to find the end
+        self.assertEqual(collected.stages['iter'][0], 3)
+        self.assertEqual(collected.counters, {'files': 3})
+        self.assertGreaterEqual(
+                collected.stages['outer'][1],
+                collected.stages['inner'][1]
+                )
+
+    def test_report(self):
+        stats.start()
+        with stats.stage('search'):
+            stats.count('files_opened')
+        collected = stats.stop()
+
+        outp = StringIO()
+        collected.report(outp, 'json')
+        data = json.loads(outp.getvalue())
+        self.assertEqual(data['stages'][0]['name'], 'search')
+        self.assertEqual(data['counters'], {'files_opened': 1})
+
+        outp = StringIO()
+        collected.report(outp, 'trace')
+        events = json.loads(outp.getvalue())['traceEvents']
+        self.assertEqual([z['ph'] for z in events], ['X', 'C'])
+
+        outp = StringIO()
+        collected.report(outp, 'text')
+        self.assertIn('files_opened', outp.getvalue())
+
+    def test_trace_threads(self):
+        """Stages run on another thread should show up on their own track."""
+        def background():
+            with stats.stage('search'):
+                pass
+
+        stats.start()
+        with stats.stage('load'):
+            thread = Thread(target=background)
+            thread.start()
+            thread.join()
+        with stats.stage('set_op'):
+            pass
+        events = stats.stop().to_trace()['traceEvents']
+
+        tids = dict((z['name'], z['tid']) for z in events if z['ph'] == 'X')
+        self.assertEqual(tids, {'load': 0, 'search': 1, 'set_op': 0})
+
+if __name__ == "__main__":
+    unittest.main()
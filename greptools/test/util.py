@@ -0,0 +1,78 @@
+"""Helpers shared by the tests."""
+import os
+import os.path
+import shutil
+import unittest
+
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from ..base import GrepTools
+
+def make_config(**kwargs):
+    """The config a greptool gets when it's run without any options, with
+    kwargs set on it."""
+    config = GrepTools.arg_parser('Test').parse_args([])
+    for key, val in kwargs.iteritems():
+        setattr(config, key, val)
+
+    return config
+
+class FakeInput(StringIO):
+    """Stands in for stdin, tty says whether it's a terminal."""
+
+    def __init__(self, data, tty):
+        StringIO.__init__(self, data or '')
+        self.tty = tty
+
+    def isatty(self):
+        return self.tty
+
+class FakeOutput(object):
+    """Stands in for stdout or stderr, collecting every chunk written. tty
+    says whether it's a terminal."""
+
+    def __init__(self, tty):
+        self.tty = tty
+        self.chunks = []
+        self.softspace = 0
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.chunks.append(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+class TempDirTestCase(unittest.TestCase):
+    """Runs each test inside a new temporary directory (self.root), which is
+    removed afterwards."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = mkdtemp()
+        os.chdir(self.root)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    @staticmethod
+    def write(path, text='', mtime=None):
+        """Write a file relative to the current directory, creating
+        directories as needed. mtime also sets it's access and modified
+        times."""
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(path, 'w') as outp:
+            outp.write(text)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))